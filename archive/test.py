@@ -17,19 +17,11 @@ def generate_options_time():
 # Function to collect real time temperature data from 6 sensors
 def collect_real_time_data():
     real_time_query = '''
-        WITH RankedData AS (
-            SELECT
-                sensorid, temperature, date, level, unit,
-                ROW_NUMBER() OVER (PARTITION BY sensorid ORDER BY date DESC) AS row_num
-            FROM 
-                data
-        )
         SELECT 
             sensorid, temperature, date, level, unit 
         FROM 
-            RankedData
+            sensor_latest
         WHERE 
-            row_num = 1 AND 
             sensorid IN ('42261f3', '42262a', '4226076', '4226087', '4226222', '42261ea');
     '''
     real_time_df = pd.read_sql_query(real_time_query, con=connection)
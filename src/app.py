@@ -1,8 +1,21 @@
+from gevent import monkey
+
+# Let psycopg2 wait on the database cooperatively when served by gunicorn's gevent
+# workers (see render.yaml), so the live heatmap streams do not each hold a thread.
+# This has to happen before any database connection is opened.
+if monkey.is_module_patched('socket'):
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
 from dash import Output, Input, State, Dash, page_container
 import dash_bootstrap_components as dbc
 
 # Import core app components
 from pages import core
+from pages.exports import export_routes
+from pages.ingest import ingest_routes
+from pages.metrics import metrics_routes
+from pages.streams import stream_routes
 
 # Initialize app
 app = Dash(
@@ -12,6 +25,10 @@ app = Dash(
     external_stylesheets=[dbc.themes.LITERA]
 )
 server = app.server
+server.register_blueprint(stream_routes)
+server.register_blueprint(export_routes)
+server.register_blueprint(ingest_routes)
+server.register_blueprint(metrics_routes)
 
 # Main app layout
 app.layout = dbc.Container(
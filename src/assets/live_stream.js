@@ -0,0 +1,56 @@
+// Applies the heatmap changes pushed by the server (see pages/streams.py) to every graph
+// inside a data-stream container, without waiting for the next dcc.Interval refresh
+(function () {
+    const sources = new Map();
+
+    // The version a container's graph shows and when it was set, read back by the
+    // clientside callback of the page's refreshes (see pages/live_data.py)
+    function setVersion(container, version) {
+        container.dataset.version = version;
+        container.dataset.versionAt = Date.now();
+    }
+
+    function connect(container) {
+        const source = new EventSource('/streams/' + container.dataset.stream);
+        // Changes pushed while the stream was down are lost, so after every (re)connect the
+        // version is cleared and the next refresh sends the full figure
+        source.onopen = function () {
+            setVersion(container, '');
+        };
+        source.onmessage = function (event) {
+            const message = JSON.parse(event.data);
+            const graph = container.querySelector('.js-plotly-plot');
+            if (!graph || !graph.data || !graph.data.length) {
+                return;
+            }
+            const z = graph.data[0].z.map(function (row) {
+                return row.slice();
+            });
+            // The first message of a stream holds every cell, the graph may be laid out for another grid
+            message.cells.forEach(function (cell) {
+                if (cell[0] < z.length && cell[1] < z[cell[0]].length) {
+                    z[cell[0]][cell[1]] = cell[2];
+                }
+            });
+            Plotly.restyle(graph, {z: [z]}, [0]);
+            setVersion(container, message.version);
+        };
+        return source;
+    }
+
+    // Graphs come and go with page navigation and modals, so the containers are re-checked every second
+    setInterval(function () {
+        const containers = new Set(document.querySelectorAll('[data-stream]'));
+        sources.forEach(function (source, container) {
+            if (!containers.has(container)) {
+                source.close();
+                sources.delete(container);
+            }
+        });
+        containers.forEach(function (container) {
+            if (!sources.has(container)) {
+                sources.set(container, connect(container));
+            }
+        });
+    }, 1000);
+})();
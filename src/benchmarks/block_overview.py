@@ -0,0 +1,66 @@
+import statistics
+import time
+
+import numpy as np
+import pandas as pd
+
+from pages.block_summary import BlockSummary
+
+### Benchmark of the server time of the block overview: summarizing the latest reading of
+### every sensor of 1,000+ blocks, against one pandas groupby over the same readings.
+### Run from the src folder:  python -m benchmarks.block_overview
+
+# (blocks, levels, units per level) of the simulated estates
+estate_sizes = [(100, 10, 10), (1000, 10, 10), (5000, 10, 10)]
+fire_threshold = 57
+repeats = 20
+
+
+# Function to generate the registry and one latest reading per sensor of an estate
+def generate_estate(blocks, levels, units, rng):
+    sensors = blocks * levels * units
+    registry_df = pd.DataFrame({
+        'block': np.repeat([f'{n:05d}' for n in range(blocks)], levels * units),
+        'level': np.tile(np.repeat(np.arange(1, levels + 1), units), blocks),
+        'unit': np.tile(np.arange(1, units + 1), blocks * levels),
+        'sensorid': [f'sensor-{n}' for n in range(sensors)],
+    })
+    readings_df = pd.DataFrame({
+        'sensorid': registry_df['sensorid'],
+        'temperature': rng.uniform(25, 65, sensors).round(1),
+    }).sample(frac=1, random_state=0)
+    return registry_df, readings_df
+
+# The straightforward summary: merge the readings onto the registry and group by block
+def summarize_groupby(registry_df, readings_df):
+    merged_df = registry_df.merge(readings_df, on='sensorid', how='left')
+    hottest_df = merged_df.loc[merged_df.groupby('block')['temperature'].idxmax()]
+    hottest_df = hottest_df.set_index('block')[['temperature', 'level', 'unit']]
+    hottest_df['units_over_threshold'] = (merged_df['temperature'] >= fire_threshold).groupby(merged_df['block']).sum()
+    return hottest_df.sort_values(by='temperature', ascending=False)
+
+# Function to return the median run time of a summary in milliseconds
+def time_summary(summarize):
+    summarize()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        summarize()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f'{"blocks":>8} {"sensors":>9} {"groupby (ms)":>14} {"BlockSummary (ms)":>19} {"+ table rows (ms)":>19}')
+    for blocks, levels, units in estate_sizes:
+        registry_df, readings_df = generate_estate(blocks, levels, units, rng)
+        summary = BlockSummary(registry_df)
+        groupby_ms = time_summary(lambda: summarize_groupby(registry_df, readings_df))
+        summary_ms = time_summary(lambda: summary.summarize(readings_df, fire_threshold))
+        rows_ms = time_summary(lambda: summary.summarize(readings_df, fire_threshold).to_dict('records'))
+        print(f'{blocks:>8,} {len(registry_df):>9,} {groupby_ms:>14.2f} {summary_ms:>19.2f} {rows_ms:>19.2f}')
+
+
+if __name__ == '__main__':
+    main()
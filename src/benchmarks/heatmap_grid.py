@@ -0,0 +1,73 @@
+import statistics
+import string
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from pages.heatmap_grid import grid_for_readings
+
+### Benchmark comparing the per-refresh build time of the live heatmap figure:
+### the previous plotly.express density_heatmap path against the precomputed grid builder.
+### Run from the src folder:  python -m benchmarks.heatmap_grid
+
+# (levels, units) of the simulated buildings: 100, 1,000 and 10,000 cells
+building_sizes = [(10, 10), (20, 50), (100, 100)]
+repeats = 20
+
+
+# Function to generate one reading per cell of a building, in the order the snapshot holds them
+def generate_readings(levels, units, rng):
+    unit_names = [string.ascii_uppercase[n % 26] + str(n // 26) for n in range(units)]
+    return pd.DataFrame({
+        'level': np.repeat(np.arange(1, levels + 1), units),
+        'unit': np.tile(unit_names, levels),
+        'temperature': rng.uniform(20, 65, levels * units).round(1),
+    })
+
+# The heatmap construction used before the grid builder
+def build_density_heatmap(real_time_df):
+    real_time_df = real_time_df.sort_values(by=['level'], ascending=True)
+    real_time_df['level'] = real_time_df['level'].astype(str)
+    heatmap = px.density_heatmap(
+        real_time_df,
+        x="unit",
+        y="level",
+        z="temperature",
+        range_color=[20, 60],
+        color_continuous_scale="temps",
+        text_auto=False,
+        labels={"unit": "Unit", "level": "Level", "temperature": ""},
+    )
+    heatmap.update_layout(margin=dict(l=0, r=0, t=0, b=0))
+    heatmap.update_traces(hovertemplate='Unit: %{x} <br>Level: %{y} <br>Temperature: %{z}')
+    heatmap.update_coloraxes(colorbar_orientation="h", colorbar_title_text="Temperature")
+    return heatmap
+
+def build_grid_heatmap(real_time_df):
+    return grid_for_readings(real_time_df).figure(real_time_df)
+
+# Function to return the median build time of a figure builder in milliseconds
+def time_builder(build, readings):
+    build(readings)
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        build(readings)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f'{"cells":>8} {"density_heatmap (ms)":>22} {"grid builder (ms)":>19} {"speedup":>9}')
+    for levels, units in building_sizes:
+        readings = generate_readings(levels, units, rng)
+        density_ms = time_builder(build_density_heatmap, readings)
+        grid_ms = time_builder(build_grid_heatmap, readings)
+        print(f'{levels * units:>8,} {density_ms:>22.2f} {grid_ms:>19.2f} {density_ms / grid_ms:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+### Benchmark of the ingest endpoint: several senders posting batches of readings to a
+### running app as fast as it accepts them, reporting the accepted rate seen by the
+### senders and the write rate the app reports at /ingest/stats.
+### Start the app against a local Postgres, then run from the src folder:
+###     python -m benchmarks.ingest --url http://127.0.0.1:8050 --seconds 30
+
+
+# Function to generate a batch of readings from distinct sensors, stamped now
+def generate_batch(rng, batch_size, sensors):
+    now = pd.Timestamp.now().isoformat()
+    sensor_numbers = rng.integers(0, sensors, batch_size)
+    temperatures = rng.uniform(25, 65, batch_size).round(1)
+    return [
+        {'sensorid': f'bench-{n}', 'temperature': float(t), 'date': now, 'level': str(n // 10 % 10 + 1), 'unit': str(n % 10 + 1)}
+        for n, t in zip(sensor_numbers, temperatures)
+    ]
+
+def post(url, body, token):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    request = urllib.request.Request(url, data=body, headers=headers, method='POST')
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+# Sender posting batches until the deadline, backing off when the app answers 503
+def sender(url, token, batch_size, sensors, deadline, results, seed):
+    rng = np.random.default_rng(seed)
+    accepted, rejected, latencies = 0, 0, []
+    while time.monotonic() < deadline:
+        body = json.dumps(generate_batch(rng, batch_size, sensors)).encode()
+        started = time.perf_counter()
+        status = post(f'{url}/ingest', body, token)
+        latencies.append(time.perf_counter() - started)
+        if status == 202:
+            accepted += batch_size
+        else:
+            rejected += batch_size
+            time.sleep(0.1)
+    results.append((accepted, rejected, latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the throughput of the ingest endpoint')
+    parser.add_argument('--url', default='http://127.0.0.1:8050')
+    parser.add_argument('--token', default=os.environ.get('INGEST_TOKEN'), help='INGEST_TOKEN of the app (default: $INGEST_TOKEN)')
+    parser.add_argument('--senders', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--sensors', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=30)
+    args = parser.parse_args()
+
+    results = []
+    deadline = time.monotonic() + args.seconds
+    senders = [
+        threading.Thread(target=sender, args=(args.url, args.token, args.batch_size, args.sensors, deadline, results, n))
+        for n in range(args.senders)
+    ]
+    started = time.monotonic()
+    for thread in senders:
+        thread.start()
+    for thread in senders:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    accepted = sum(result[0] for result in results)
+    rejected = sum(result[1] for result in results)
+    latencies = sorted(latency for result in results for latency in result[2])
+    print(f'accepted {accepted:,} readings in {elapsed:.1f}s: {accepted / elapsed:,.0f} readings/s ({rejected:,} turned away)')
+    print(f'request latency p50 {statistics.median(latencies) * 1000:.1f} ms, p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms')
+    with urllib.request.urlopen(f'{args.url}/ingest/stats') as response:
+        print(f'app reports {json.loads(response.read())}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import os
+import statistics
+import time
+
+# The benchmark runs on its own connection, the app's pool must not connect ahead of use
+os.environ.setdefault('DB_POOL_MIN_SIZE', '0')
+
+import psycopg2
+
+from pages.live_data import ensure_sensor_latest, latest_readings_query
+
+### Benchmark comparing the old window-function live query against the sensor_latest table
+### as the data table grows from 10k to 10M rows.
+### Run from the src folder against a local Postgres:  python -m benchmarks.latest_readings
+### The connection string is read from BENCH_DSN (default: "dbname=postgres host=localhost").
+### Everything is created inside a scratch schema that is dropped at the end.
+
+table_sizes = [10_000, 100_000, 1_000_000, 10_000_000]
+sensor_count = 600
+repeats = 20
+insert_chunk = 1_000_000
+
+live_sensor_ids = [f'sensor-{n}' for n in range(6)]
+
+ranked_query = '''
+    WITH RankedData AS (
+        SELECT
+            sensorid, temperature, date, level, unit,
+            ROW_NUMBER() OVER (PARTITION BY sensorid ORDER BY date DESC) AS row_num
+        FROM
+            data
+    )
+    SELECT
+        sensorid, temperature, date, level, unit
+    FROM
+        RankedData
+    WHERE
+        row_num = 1 AND
+        sensorid = ANY(%(sensor_ids)s);
+'''
+
+# One reading per second, spread round-robin over all sensors
+insert_query = '''
+    INSERT INTO data (sensorid, temperature, date, level, unit)
+    SELECT
+        'sensor-' || (n %% %(sensors)s),
+        20 + random() * 40,
+        timestamp '2023-01-01' + n * interval '1 second',
+        ((n %% %(sensors)s) / 10 + 1)::text,
+        (1400 + (n %% %(sensors)s) %% 10)::text
+    FROM
+        generate_series(%(first)s, %(last)s) AS n;
+'''
+
+
+# Function to create an empty data table in the scratch schema and attach sensor_latest to it
+def setup_schema(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('DROP SCHEMA IF EXISTS firenet_bench CASCADE')
+        cursor.execute('CREATE SCHEMA firenet_bench')
+        cursor.execute('SET search_path TO firenet_bench')
+        cursor.execute('CREATE TABLE data (sensorid text, temperature real, date timestamp, level text, unit text)')
+    connection.commit()
+    ensure_sensor_latest(connection)
+
+# Function to append rows [first, last) to the data table, going through the ingest trigger
+def grow_data(connection, first, last):
+    with connection.cursor() as cursor:
+        for chunk_start in range(first, last, insert_chunk):
+            chunk_end = min(chunk_start + insert_chunk, last) - 1
+            cursor.execute(insert_query, {'sensors': sensor_count, 'first': chunk_start, 'last': chunk_end})
+            connection.commit()
+        cursor.execute('ANALYZE data')
+    connection.commit()
+
+# Function to return the median latency of a query in milliseconds
+def time_query(connection, query):
+    timings = []
+    with connection.cursor() as cursor:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            cursor.execute(query, {'sensor_ids': live_sensor_ids})
+            cursor.fetchall()
+            timings.append(time.perf_counter() - start)
+    connection.rollback()
+    return statistics.median(timings) * 1000
+
+
+def main():
+    connection = psycopg2.connect(os.environ.get('BENCH_DSN', 'dbname=postgres host=localhost'))
+    try:
+        setup_schema(connection)
+        print(f'{"rows":>12} {"window scan (ms)":>18} {"sensor_latest (ms)":>20}')
+        rows = 0
+        for size in table_sizes:
+            grow_data(connection, rows, size)
+            rows = size
+            ranked_ms = time_query(connection, ranked_query)
+            latest_ms = time_query(connection, latest_readings_query)
+            print(f'{rows:>12,} {ranked_ms:>18.2f} {latest_ms:>20.2f}')
+    finally:
+        connection.rollback()
+        with connection.cursor() as cursor:
+            cursor.execute('DROP SCHEMA IF EXISTS firenet_bench CASCADE')
+        connection.commit()
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,376 @@
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from pages.heatmap_demo_csv_generator import unit_name
+from pages.scenario import Fire, Scenario
+
+### Load test of a running app: synthetic sensor streams for many buildings plus simulated
+### dashboard viewers calling the live and historical callbacks through /_dash-update-component.
+### Reports p50/p95/p99 latency per callback and the database queries run during the test.
+### Start the app, then run from the src folder, e.g.:
+###     python -m benchmarks.loadtest --buildings 50 --fires 2 --live-clients 20 --historical-clients 5 --seconds 60
+### Readings go to the Postgres at BENCH_DSN (--sink postgres), through the app's /ingest
+### endpoint (--sink ingest) or into an in-memory stand-in that only keeps the latest reading
+### per sensor (--sink memory), to load the clients without writing readings. Whatever the
+### sink, the simulated buildings are added to the app's sensor registry at BENCH_DSN and the
+### test stops before measuring if the app does not serve them.
+
+BENCH_DSN = os.environ.get('BENCH_DSN', 'dbname=postgres host=localhost')
+
+# Readings per COPY or ingest request
+SINK_BATCH_SIZE = 5000
+
+register_sensors = '''
+    INSERT INTO sensor_registry (block, level, unit, sensorid)
+    VALUES %s
+    ON CONFLICT (sensorid) DO NOTHING
+'''
+
+# Statements run by the database, from pg_stat_statements when installed and otherwise
+# the committed and rolled back transactions of the database
+statement_count_query = 'SELECT sum(calls)::bigint FROM pg_stat_statements WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())'
+transaction_count_query = 'SELECT xact_commit + xact_rollback FROM pg_stat_database WHERE datname = current_database()'
+
+
+#-------------------------- Sensor streams --------------------------#
+# Simulated building streaming one reading per unit per tick, its temperatures computed
+# frame by frame by a fire scenario
+class SimulatedBuilding:
+    def __init__(self, block, scenario):
+        self.block = block
+        self.scenario = scenario
+        self.levels = scenario.levels
+        self.units = scenario.units
+        self.sensor_rows = self.sensors()
+
+    def sensors(self):
+        return [
+            (f'lt-{self.block}-{level + 1}-{unit}', str(level + 1), unit_name(unit))
+            for level in range(self.levels) for unit in range(self.units)
+        ]
+
+    # Function to advance the building by `seconds` and return the readings stamped with `date`
+    def readings(self, seconds, date):
+        temperatures = self.scenario.step(seconds).ravel().tolist()
+        return [
+            (sensorid, temperature, date, level, unit)
+            for (sensorid, level, unit), temperature in zip(self.sensor_rows, temperatures)
+        ]
+
+
+# Function to create `count` buildings, `fires` of which catch fire on a random level
+# fire_after seconds into the test. Building n runs the scenario seeded with seed + n.
+def simulated_buildings(count, levels, units, fires, fire_after, rng, seed=0):
+    on_fire = set(rng.sample(range(count), min(fires, count)))
+    buildings = []
+    for n in range(count):
+        fire_list = []
+        if n in on_fire:
+            first_unit = rng.randrange(units)
+            fire_list.append(Fire(rng.randint(1, levels), range(first_unit, min(units, first_unit + 3)), fire_after))
+        buildings.append(SimulatedBuilding(f'LT{n:04d}', Scenario(levels, units, fire_list, seed=seed + n)))
+    return buildings
+
+
+# Function to add the simulated buildings to the app's sensor registry, whatever the sink,
+# so the pages serve them. The app re-reads its registry on the first request for a block
+# it does not know yet. Raises SystemExit when the registry cannot be written.
+def register_buildings(dsn, buildings):
+    try:
+        connection = psycopg2.connect(dsn)
+    except psycopg2.Error as error:
+        raise SystemExit(f'Could not connect to --dsn to register the simulated buildings: {error}')
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('sensor_registry')")
+            if cursor.fetchone()[0] is None:
+                raise SystemExit('sensor_registry does not exist yet, open the app once before the load test')
+            rows = [(building.block, level, unit, sensorid) for building in buildings for sensorid, level, unit in building.sensors()]
+            execute_values(cursor, register_sensors, rows, page_size=1000)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+class PostgresSink:
+    def __init__(self, dsn):
+        self.connection = psycopg2.connect(dsn)
+
+    def write(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        with self.connection.cursor() as cursor:
+            cursor.copy_expert('COPY data (sensorid, temperature, date, level, unit) FROM STDIN WITH (FORMAT csv)', buffer)
+        self.connection.commit()
+
+
+class IngestSink:
+    def __init__(self, url, token):
+        self.url = f'{url}/ingest'
+        self.token = token
+
+    def write(self, rows):
+        readings = [
+            {'sensorid': sensorid, 'temperature': temperature, 'date': date.isoformat(), 'level': level, 'unit': unit}
+            for sensorid, temperature, date, level, unit in rows
+        ]
+        status, _ = post_json(self.url, readings, self.token)
+        if status != 202:
+            raise RuntimeError(f'ingest answered {status}')
+
+
+# In-memory stand-in for the database, keeping only the latest reading of every sensor
+class MemorySink:
+    def __init__(self):
+        self.latest = {}
+
+    def write(self, rows):
+        for row in rows:
+            self.latest[row[0]] = row
+
+
+# Thread writing one reading per sensor of every building every 1/rate seconds
+class StreamGenerator:
+    def __init__(self, buildings, sink, rate):
+        self.buildings = buildings
+        self.sink = sink
+        self.interval = 1 / rate
+        self.written = 0
+        self.failed = 0
+        self.late_ticks = 0
+
+    def run(self, deadline):
+        next_tick = time.monotonic()
+        while next_tick < deadline:
+            date = datetime.now().replace(microsecond=0)
+            rows = [row for building in self.buildings for row in building.readings(self.interval, date)]
+            for first in range(0, len(rows), SINK_BATCH_SIZE):
+                batch = rows[first:first + SINK_BATCH_SIZE]
+                try:
+                    self.sink.write(batch)
+                    self.written += len(batch)
+                except Exception as error:
+                    self.failed += len(batch)
+                    print(f'Writing readings failed: {error}')
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.late_ticks += 1
+
+
+#-------------------------- Dashboard clients --------------------------#
+def post_json(url, payload, token=None):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), headers=headers, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            body = response.read()
+            return response.status, (json.loads(body) if body else None)
+    except urllib.error.HTTPError as error:
+        return error.code, None
+
+# Request body of a Dash callback, with the inputs and states in the order the callback declares them
+def callback_payload(outputs, inputs, state, changed):
+    output_ids = [{'id': component_id, 'property': prop} for component_id, prop in outputs]
+    return {
+        'output': '..' + '...'.join(f'{component_id}.{prop}' for component_id, prop in outputs) + '..' if len(outputs) > 1 else f'{outputs[0][0]}.{outputs[0][1]}',
+        'outputs': output_ids if len(outputs) > 1 else output_ids[0],
+        'inputs': [{'id': component_id, 'property': prop, 'value': value} for component_id, prop, value in inputs],
+        'state': [{'id': component_id, 'property': prop, 'value': value} for component_id, prop, value in state],
+        'changedPropIds': [changed],
+    }
+
+# Latencies of one callback across every simulated client. Only calls answered with an update
+# (200) are timed, calls Dash answered with no update (204, the callback did no work) and
+# failed calls are counted apart so they cannot flatter the percentiles.
+class CallbackStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.no_updates = 0
+        self.errors = 0
+
+    def record(self, seconds, status):
+        with self.lock:
+            if status == 200:
+                self.latencies.append(seconds)
+            elif status == 204:
+                self.no_updates += 1
+            else:
+                self.errors += 1
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        counts = f'{len(latencies):>7,} updates {self.no_updates:>5,} no-updates {self.errors:>5,} errors'
+        if not latencies:
+            return counts
+        percentile = lambda p: latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+        return f'{counts}   p50 {percentile(50):>8.1f} ms   p95 {percentile(95):>8.1f} ms   p99 {percentile(99):>8.1f} ms'
+
+
+def live_payload(block, n_intervals, version):
+    return callback_payload(
+        outputs=[('block-heatmap', 'figure'), ('heatmap-version', 'data')],
+        inputs=[('interval-component', 'n_intervals', n_intervals)],
+        state=[('heatmap-version', 'data', version), ('heatmap-block-select', 'value', block)],
+        changed='interval-component.n_intervals'
+    )
+
+# Function to check, before measuring, that the app serves every block the clients will view.
+# The first request for a block makes the app re-read its registry, a block that still gets no
+# update was not registered (or the app is too old to re-read its registry) and would only
+# measure callbacks doing nothing.
+def check_blocks(url, blocks):
+    unknown = []
+    for block in blocks:
+        status, _ = post_json(f'{url}/_dash-update-component', live_payload(block, 1, None))
+        if status != 200:
+            unknown.append(f'{block} ({status})')
+    if unknown:
+        raise SystemExit(f'The app does not serve the simulated blocks {", ".join(unknown)}, restart it and retry')
+
+# Viewer of a block's live heatmap, polling like the page's fallback interval does
+def live_client(url, block, interval, deadline, stats):
+    version, n_intervals = None, 0
+    while time.monotonic() < deadline:
+        n_intervals += 1
+        payload = live_payload(block, n_intervals, version)
+        started = time.perf_counter()
+        status, body = post_json(f'{url}/_dash-update-component', payload)
+        stats.record(time.perf_counter() - started, status)
+        if status == 200 and body:
+            version = body.get('response', {}).get('heatmap-version', {}).get('data', version)
+        time.sleep(interval)
+
+# Viewer of a block's history, picking a new date range every call
+def historical_client(url, block, history_days, interval, deadline, stats, rng):
+    while time.monotonic() < deadline:
+        end = datetime.now() - timedelta(days=rng.uniform(0, history_days))
+        start = end - timedelta(hours=rng.choice([1, 6, 24, 24 * 7]))
+        date_range = [start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')]
+        payload = callback_payload(
+            outputs=[('historical-graph', 'figure')],
+            inputs=[
+                ('date-range-picker', 'value', date_range),
+                ('date-range-picker', 'value', date_range),
+                ('start-time-selector', 'value', start.strftime('%H:00')),
+                ('end-time-selector', 'value', end.strftime('%H:00')),
+                ('historical-graph', 'relayoutData', None),
+                ('rate-of-rise-toggle', 'value', rng.random() < 0.5),
+                ('rate-of-rise-threshold', 'value', 8.3),
+            ],
+            state=[('historical-line-select', 'value', []), ('historical-block-select', 'value', block)],
+            changed='date-range-picker.value'
+        )
+        started = time.perf_counter()
+        status, _ = post_json(f'{url}/_dash-update-component', payload)
+        stats.record(time.perf_counter() - started, status)
+        time.sleep(interval)
+
+
+#-------------------------- Database counters --------------------------#
+# Function to return (label, counter) of the statements or transactions run so far
+def database_counter(dsn):
+    try:
+        connection = psycopg2.connect(dsn)
+    except psycopg2.Error:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(statement_count_query)
+                return 'statements', cursor.fetchone()[0] or 0
+            except psycopg2.Error:
+                connection.rollback()
+                cursor.execute(transaction_count_query)
+                return 'transactions', cursor.fetchone()[0]
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the app with simulated buildings and dashboard viewers')
+    parser.add_argument('--url', default='http://127.0.0.1:8050', help='base URL of the running app')
+    parser.add_argument('--dsn', default=BENCH_DSN, help='database of the app, for registering the buildings, the postgres sink and query counts')
+    parser.add_argument('--sink', choices=['postgres', 'ingest', 'memory'], default='postgres')
+    parser.add_argument('--token', help='INGEST_TOKEN of the app, for the ingest sink')
+    parser.add_argument('--buildings', type=int, default=10)
+    parser.add_argument('--levels', type=int, default=10)
+    parser.add_argument('--units', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=1, help='readings per sensor per second')
+    parser.add_argument('--fires', type=int, default=1, help='buildings catching fire during the test')
+    parser.add_argument('--fire-after', type=float, default=10, help='seconds into the test the fires start')
+    parser.add_argument('--live-clients', type=int, default=10)
+    parser.add_argument('--historical-clients', type=int, default=2)
+    parser.add_argument('--poll-interval', type=float, default=1, help='seconds between calls of each client')
+    parser.add_argument('--history-days', type=float, default=7, help='how far back historical clients look')
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    buildings = simulated_buildings(args.buildings, args.levels, args.units, args.fires, args.fire_after, rng, args.seed)
+    if args.sink == 'postgres':
+        sink = PostgresSink(args.dsn)
+    elif args.sink == 'ingest':
+        sink = IngestSink(args.url, args.token)
+    else:
+        sink = MemorySink()
+    register_buildings(args.dsn, buildings)
+    check_blocks(args.url, sorted({buildings[n % len(buildings)].block for n in range(max(args.live_clients, args.historical_clients))}))
+
+    generator = StreamGenerator(buildings, sink, args.rate)
+    live_stats, historical_stats = CallbackStats(), CallbackStats()
+    counter_before = database_counter(args.dsn)
+    deadline = time.monotonic() + args.seconds
+    threads = [threading.Thread(target=generator.run, args=(deadline,))]
+    for n in range(args.live_clients):
+        block = buildings[n % len(buildings)].block
+        threads.append(threading.Thread(target=live_client, args=(args.url, block, args.poll_interval, deadline, live_stats)))
+    for n in range(args.historical_clients):
+        block = buildings[n % len(buildings)].block
+        threads.append(threading.Thread(
+            target=historical_client,
+            args=(args.url, block, args.history_days, args.poll_interval, deadline, historical_stats, random.Random(args.seed + n))
+        ))
+
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    counter_after = database_counter(args.dsn)
+
+    sensors = sum(building.levels * building.units for building in buildings)
+    print(f'{len(buildings)} buildings, {sensors:,} sensors, {args.live_clients} live and {args.historical_clients} historical clients, {elapsed:.0f}s')
+    print(f'readings   {generator.written:>10,} written ({generator.written / elapsed:,.0f}/s), '
+          f'{generator.failed:,} failed, {generator.late_ticks} late ticks')
+    print(f'live       {live_stats.report()}')
+    print(f'historical {historical_stats.report()}')
+    if counter_before is not None and counter_after is not None:
+        label, count = counter_after[0], counter_after[1] - counter_before[1]
+        print(f'database   {count:>10,} {label} ({count / elapsed:,.0f}/s, includes the load test\'s own writes)')
+    else:
+        print('database   query counts unavailable, could not connect to --dsn')
+
+
+if __name__ == '__main__':
+    main()
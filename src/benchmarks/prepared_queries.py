@@ -0,0 +1,101 @@
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+# The benchmark runs on its own connection, the app's pool must not connect ahead of use
+os.environ.setdefault('DB_POOL_MIN_SIZE', '0')
+
+import psycopg2
+
+from benchmarks.latest_readings import grow_data, sensor_count, setup_schema
+from pages.live_data import latest_readings_statement
+from pages.prepared import PreparingConnection
+from pages.rollups import ensure_rollups, raw_series_statement, rollup_statements
+
+### Benchmark of the per-call latency of the live and historical queries, sent as plain
+### statements (parsed and planned on every call) against server-side prepared statements.
+### Run from the src folder against a local Postgres:  python -m benchmarks.prepared_queries
+### The connection string is read from BENCH_DSN (default: "dbname=postgres host=localhost").
+### Everything is created inside a scratch schema that is dropped at the end.
+
+data_rows = 1_000_000
+repeats = 200
+# Calls of each mode run untimed first, to prepare the statements and warm the buffer cache
+warmup_calls = 20
+# Readings start at 2023-01-01 with one per second, see benchmarks/latest_readings.py
+data_start = datetime(2023, 1, 1)
+
+
+# Function to return the parameters of one live call: a random block's sensors
+def live_params(rng):
+    first = rng.randrange(sensor_count - 6)
+    return {'sensor_ids': [f'sensor-{n}' for n in range(first, first + 6)]}
+
+# Function to return the parameters of one historical call: a random block's sensors over a random window of `hours`
+def window_params(rng, hours):
+    params = live_params(rng)
+    start = data_start + timedelta(seconds=rng.uniform(0, data_rows - hours * 3600))
+    return dict(params, start=start, end=start + timedelta(hours=hours))
+
+# Function to return the median and 95th percentile latency in milliseconds of every mode,
+# where a mode is a function `run(cursor, params)`. After a warm-up pass (which also prepares
+# the statement) the modes take turns call by call, alternating which one goes first, and
+# every call gets its own parameters, so no mode reads windows another one just cached.
+def time_modes(connection, modes, make_params):
+    timings = {name: [] for name in modes}
+    with connection.cursor() as cursor:
+        for _ in range(warmup_calls):
+            for run in modes.values():
+                run(cursor, make_params())
+                cursor.fetchall()
+        for n in range(repeats):
+            for name, run in (list(modes.items()) if n % 2 == 0 else list(modes.items())[::-1]):
+                params = make_params()
+                start = time.perf_counter()
+                run(cursor, params)
+                cursor.fetchall()
+                timings[name].append(time.perf_counter() - start)
+    connection.rollback()
+    results = {}
+    for name, values in timings.items():
+        values.sort()
+        results[name] = (statistics.median(values) * 1000, values[int(0.95 * (len(values) - 1))] * 1000)
+    return results
+
+
+def main():
+    connection = psycopg2.connect(os.environ.get('BENCH_DSN', 'dbname=postgres host=localhost'), connection_factory=PreparingConnection)
+    rng = random.Random(0)
+    try:
+        setup_schema(connection)
+        grow_data(connection, 0, data_rows)
+        ensure_rollups(connection)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        connection.commit()
+
+        cases = [('live latest readings', latest_readings_statement, lambda: live_params(rng))]
+        cases.append(('raw series, 1 hour', raw_series_statement, lambda: window_params(rng, 1)))
+        for table, statement in rollup_statements.items():
+            cases.append((f'{table}, 1 day', statement, lambda: window_params(rng, 24)))
+
+        print(f'{"query":<32} {"plain p50":>10} {"p95 (ms)":>9} {"prepared p50":>13} {"p95 (ms)":>9}')
+        for label, statement, make_params in cases:
+            results = time_modes(connection, {
+                'plain': lambda cursor, params: cursor.execute(statement.query, params),
+                'prepared': statement.execute,
+            }, make_params)
+            plain, prepared = results['plain'], results['prepared']
+            print(f'{label:<32} {plain[0]:>10.3f} {plain[1]:>9.3f} {prepared[0]:>13.3f} {prepared[1]:>9.3f}')
+    finally:
+        connection.rollback()
+        with connection.cursor() as cursor:
+            cursor.execute('DROP SCHEMA IF EXISTS firenet_bench CASCADE')
+        connection.commit()
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import statistics
+import time
+
+import numpy as np
+import pandas as pd
+
+from pages.rate_of_rise import first_crossing, rate_of_rise
+
+### Benchmark of the rate-of-rise overlay on raw readings: a week of 1 Hz data for every
+### unit of a block, against a per-row Python loop over the same readings, reported per block
+### and per unit.
+### Run from the src folder:  python -m benchmarks.rate_of_rise
+
+# Units per simulated block: Block 123 and a larger block
+block_sizes = [6, 24]
+days = 7
+window = 60
+rise_threshold = 8.3
+repeats = 5
+
+
+# Function to generate a week of 1 Hz readings of one unit, room temperature with a fire on the last day
+def generate_series(rng):
+    index = pd.date_range('2023-09-01', periods=days * 24 * 3600, freq='1s')
+    temperature = 30 + rng.normal(0, 0.3, len(index))
+    fire_start = len(index) - 6 * 3600
+    temperature[fire_start:] += np.minimum(np.arange(len(index) - fire_start) / 6, 35)
+    return pd.Series(temperature, index=index)
+
+# The straightforward version: for every reading, walk back to the reading one window earlier
+def rate_of_rise_loop(series):
+    times = [timestamp.timestamp() for timestamp in series.index]
+    values = list(series.values)
+    rates, earlier = [], 0
+    for n in range(len(values)):
+        while times[n] - times[earlier] > window:
+            earlier += 1
+        span = times[n] - times[earlier]
+        rates.append((values[n] - values[earlier]) / span * 60 if span >= window / 2 else float('nan'))
+    return rates
+
+def rate_of_rise_vectorized(series):
+    rate, _ = rate_of_rise(series, window)
+    return first_crossing(rate, rise_threshold)
+
+# Function to return the median time to process every unit of a block in seconds
+def time_block(compute, block, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for series in block:
+            compute(series)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    print(f'{"units":>6} {"readings":>12} {"path":>11} {"block (ms)":>11} {"per unit (ms)":>14} {"readings/s":>13}')
+    for units in block_sizes:
+        block = [generate_series(rng) for _ in range(units)]
+        readings = sum(len(series) for series in block)
+        # Both paths process the same readings, the loop only runs once as it takes a while
+        for label, compute, runs in [('vectorized', rate_of_rise_vectorized, repeats), ('python loop', rate_of_rise_loop, 1)]:
+            seconds = time_block(compute, block, runs)
+            print(f'{units:>6} {readings:>12,} {label:>11} {seconds * 1000:>11.1f} {seconds * 1000 / units:>14.1f} {readings / seconds:>13,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.loadtest import BENCH_DSN, SINK_BATCH_SIZE, IngestSink, MemorySink, PostgresSink, register_buildings, simulated_buildings
+from pages.scenario import MAX_LEVELS, MAX_UNITS
+
+### Replay of seeded fire scenarios into the database at accelerated time, to fill the live
+### and historical paths with realistic data. Every building runs its own scenario and sends
+### one reading per unit every --interval scenario seconds, --speed times faster than real
+### time (0 replays as fast as the sink takes it). Run from the src folder, e.g. a day of
+### history for 20 large buildings, then an hour live at 60x:
+###     python -m benchmarks.replay --buildings 20 --levels 200 --units 50 --fires 3 --hours 24 --start 2023-09-01T00:00 --speed 0
+###     python -m benchmarks.replay --buildings 20 --levels 200 --units 50 --fires 3 --hours 1 --speed 60
+### The same --seed replays the same readings.
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay seeded fire scenarios at accelerated time')
+    parser.add_argument('--dsn', default=BENCH_DSN, help='database of the app, for registering the buildings and the postgres sink')
+    parser.add_argument('--url', default='http://127.0.0.1:8050', help='base URL of the running app, for the ingest sink')
+    parser.add_argument('--sink', choices=['postgres', 'ingest', 'memory'], default='postgres')
+    parser.add_argument('--token', help='INGEST_TOKEN of the app, for the ingest sink')
+    parser.add_argument('--buildings', type=int, default=10)
+    parser.add_argument('--levels', type=int, default=10, help=f'up to {MAX_LEVELS}')
+    parser.add_argument('--units', type=int, default=10, help=f'up to {MAX_UNITS}')
+    parser.add_argument('--fires', type=int, default=1, help='buildings catching fire')
+    parser.add_argument('--fire-after', type=float, default=600, help='scenario seconds before the fires start')
+    parser.add_argument('--hours', type=float, default=1, help='scenario time to replay')
+    parser.add_argument('--interval', type=float, default=10, help='scenario seconds between readings of a sensor')
+    parser.add_argument('--speed', type=float, default=60, help='scenario seconds per second, 0 for as fast as possible')
+    parser.add_argument('--start', type=datetime.fromisoformat, help='date of the first readings, now by default')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    buildings = simulated_buildings(args.buildings, args.levels, args.units, args.fires, args.fire_after, random.Random(args.seed), args.seed)
+    if args.sink == 'postgres':
+        sink = PostgresSink(args.dsn)
+    elif args.sink == 'ingest':
+        sink = IngestSink(args.url, args.token)
+    else:
+        sink = MemorySink()
+    # Readings kept in memory never reach the app, there is nothing for it to show
+    if args.sink != 'memory':
+        register_buildings(args.dsn, buildings)
+
+    start = (args.start or datetime.now()).replace(microsecond=0)
+    frames = int(args.hours * 3600 / args.interval)
+    written, simulating, writing, late_frames = 0, 0.0, 0.0, 0
+    started = time.monotonic()
+    for frame in range(frames):
+        date = start + timedelta(seconds=frame * args.interval)
+        step_started = time.perf_counter()
+        rows = [row for building in buildings for row in building.readings(args.interval, date)]
+        write_started = time.perf_counter()
+        for first in range(0, len(rows), SINK_BATCH_SIZE):
+            sink.write(rows[first:first + SINK_BATCH_SIZE])
+        written += len(rows)
+        simulating += write_started - step_started
+        writing += time.perf_counter() - write_started
+
+        if args.speed > 0:
+            delay = started + (frame + 1) * args.interval / args.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                late_frames += 1
+    elapsed = time.monotonic() - started
+
+    sensors = sum(building.levels * building.units for building in buildings)
+    replayed = frames * args.interval
+    print(f'{len(buildings)} buildings, {sensors:,} sensors, {frames:,} frames covering {replayed / 3600:.2f}h '
+          f'from {start:%Y-%m-%d %H:%M} in {elapsed:.1f}s ({replayed / max(elapsed, 1e-9):,.0f}x)')
+    print(f'readings   {written:>12,} written ({written / max(elapsed, 1e-9):,.0f}/s), {late_frames} late frames')
+    print(f'scenario   {simulating:>10.2f}s   sink {writing:>10.2f}s')
+    if isinstance(sink, MemorySink):
+        burning = sum(int(building.scenario.burning.sum()) for building in buildings)
+        print(f'memory     {len(sink.latest):>12,} sensors with a reading, {burning:,} units burning')
+
+
+if __name__ == '__main__':
+    main()
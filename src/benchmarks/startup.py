@@ -0,0 +1,59 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+### Benchmark of the app's start-up time: from the start of the import to the first page
+### served, with the database reachable, refusing connections and silently dropping them.
+### Run from the src folder:  python -m benchmarks.startup
+### The reachable case uses the DB_* settings of the environment; the other two override DB_HOST.
+
+repeats = 5
+
+scenarios = [
+    ('configured database', {}),
+    ('connection refused', {'DB_HOST': '127.0.0.1', 'DB_PORT': '9'}),
+    # A non-routable address: connection attempts hang until DB_CONNECT_TIMEOUT
+    ('unreachable host', {'DB_HOST': '10.255.255.1', 'DB_CONNECT_TIMEOUT': '10'}),
+]
+
+# Run in a fresh interpreter: import the app the way gunicorn does, then serve the home page
+measure_startup = '''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+status = app.server.test_client().get('/').status_code
+ready = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000, 'ready_ms': (ready - started) * 1000, 'status': status}))
+'''
+
+
+def run_once(environment):
+    result = subprocess.run(
+        [sys.executable, '-c', measure_startup],
+        env={**os.environ, **environment},
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    if result.returncode != 0:
+        return None
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    print(f'{"scenario":<22} {"import (ms)":>12} {"first page (ms)":>16} {"status":>7}')
+    for name, environment in scenarios:
+        runs = [run_once(environment) for _ in range(repeats)]
+        if any(run is None for run in runs):
+            print(f'{name:<22} {"failed to start":>37}')
+            continue
+        import_ms = statistics.median(run['import_ms'] for run in runs)
+        ready_ms = statistics.median(run['ready_ms'] for run in runs)
+        print(f'{name:<22} {import_ms:>12.0f} {ready_ms:>16.0f} {runs[0]["status"]:>7}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+import argparse
+import json
+import logging
+import math
+import os
+import threading
+import time
+from array import array
+from collections import deque
+
+import pandas as pd
+
+from pages.database import connection_settings, data_now, pool
+from pages.live_data import NotificationListener
+from pages.prepared import PreparedStatement
+from pages.registry import get_registry
+
+### This file contains the alerting engine evaluating every incoming reading against the fire rules.
+### Run it as its own process from the src folder, so alerts do not depend on anyone watching a page:
+###     python -m pages.alerts watch [--file alerts.jsonl]
+
+
+# Temperature at or above which a unit is on fire
+FIRE_THRESHOLD = 57
+# Rate of rise at or above which a unit is heating up like a fire, in °C per minute
+# (the usual rate-of-rise heat detector setting of 15°F per minute)
+RATE_OF_RISE = 8.3
+# Seconds of readings the rate of rise is measured over, and the shortest span it is trusted on
+RATE_WINDOW = 60
+RATE_MIN_SPAN = 20
+# Temperature at or above which a unit and its neighbours count as heating up together
+NEIGHBOR_THRESHOLD = 50
+# Adjacent units (same level next unit, or same unit next level) that must be that hot as well
+MIN_HOT_NEIGHBORS = 1
+
+# Readings kept per sensor, enough for the rate window at one reading per second
+WINDOW_CAPACITY = 128
+# Recent reading-to-alert latencies kept for the latency report
+LATENCY_SAMPLES = 1000
+# Seconds between latency reports and between retries after a failed poll
+REPORT_INTERVAL = 60
+FEED_RETRY_DELAY = 5
+
+
+# Fixed-size ring buffer of one sensor's recent (time, temperature) readings.
+# Appending and expiring are O(1) per reading and the buffer never reallocates.
+class SensorWindow:
+    __slots__ = ('times', 'temperatures', 'start', 'count')
+
+    def __init__(self, capacity):
+        self.times = array('d', bytes(8 * capacity))
+        self.temperatures = array('d', bytes(8 * capacity))
+        self.start = 0
+        self.count = 0
+
+    def append(self, reading_time, temperature):
+        capacity = len(self.times)
+        if self.count == capacity:
+            self.start = (self.start + 1) % capacity
+            self.count -= 1
+        end = (self.start + self.count) % capacity
+        self.times[end] = reading_time
+        self.temperatures[end] = temperature
+        self.count += 1
+
+    # Function to drop the readings taken before the given time
+    def expire(self, before):
+        capacity = len(self.times)
+        while self.count and self.times[self.start] < before:
+            self.start = (self.start + 1) % capacity
+            self.count -= 1
+
+    def oldest(self):
+        return self.times[self.start], self.temperatures[self.start]
+
+    def latest(self):
+        end = (self.start + self.count - 1) % len(self.times)
+        return self.times[end], self.temperatures[end]
+
+
+# Each rule returns a message when the sensor's latest reading breaks it, None otherwise
+
+class ThresholdRule:
+    name = 'threshold'
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.window = 0
+
+    def evaluate(self, engine, sensorid, window):
+        temperature = window.latest()[1]
+        if temperature >= self.threshold:
+            return f'{temperature:.1f}°C is at or above {self.threshold}°C'
+        return None
+
+
+class RateOfRiseRule:
+    name = 'rate_of_rise'
+
+    def __init__(self, rise_per_minute, window, min_span):
+        self.rise_per_minute = rise_per_minute
+        self.window = window
+        self.min_span = min_span
+
+    def evaluate(self, engine, sensorid, window):
+        latest_time, latest_temperature = window.latest()
+        oldest_time, oldest_temperature = window.oldest()
+        span = latest_time - oldest_time
+        if span < self.min_span:
+            return None
+        rise = (latest_temperature - oldest_temperature) / span * 60
+        if rise >= self.rise_per_minute:
+            return f'rising {rise:.1f}°C/min over the last {span:.0f}s'
+        return None
+
+
+class NeighborRule:
+    name = 'neighbors'
+
+    def __init__(self, threshold, min_neighbors):
+        self.threshold = threshold
+        self.min_neighbors = min_neighbors
+        self.window = 0
+
+    def evaluate(self, engine, sensorid, window):
+        if window.latest()[1] < self.threshold:
+            return None
+        hot = [
+            neighbor for neighbor in engine.neighbors.get(sensorid, ())
+            if engine.latest_temperature(neighbor) >= self.threshold
+        ]
+        if len(hot) >= self.min_neighbors:
+            return f'{len(hot)} adjacent unit(s) also at or above {self.threshold}°C'
+        return None
+
+
+def default_rules():
+    return [
+        ThresholdRule(FIRE_THRESHOLD),
+        RateOfRiseRule(RATE_OF_RISE, RATE_WINDOW, RATE_MIN_SPAN),
+        NeighborRule(NEIGHBOR_THRESHOLD, MIN_HOT_NEIGHBORS),
+    ]
+
+
+# Function to map every registered sensor to the sensors of the adjacent units in its block
+def sensor_neighbors(registry):
+    neighbors = {}
+    for block in registry.blocks:
+        sensors_df = registry.block_sensors[block]
+        levels, units = list(registry.levels(block)), list(registry.units(block))
+        positions = {
+            (levels.index(level), units.index(unit)): sensorid
+            for sensorid, level, unit in zip(sensors_df['sensorid'], sensors_df['level'], sensors_df['unit'])
+        }
+        for (row, column), sensorid in positions.items():
+            adjacent = [(row - 1, column), (row + 1, column), (row, column - 1), (row, column + 1)]
+            neighbors[sensorid] = [positions[position] for position in adjacent if position in positions]
+    return neighbors
+
+
+# Rolling summary of recent reading-to-alert latencies
+class LatencyStats:
+    def __init__(self, samples):
+        self.latencies = deque(maxlen=samples)
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def report(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if not latencies:
+            return {'count': 0}
+        percentile = lambda p: latencies[min(len(latencies) - 1, math.ceil(p / 100 * len(latencies)) - 1)] * 1000
+        return {
+            'count': len(latencies),
+            'p50_ms': round(percentile(50), 3),
+            'p95_ms': round(percentile(95), 3),
+            'p99_ms': round(percentile(99), 3),
+            'max_ms': round(latencies[-1] * 1000, 3),
+        }
+
+
+# Alerting engine evaluating every reading as it arrives. Each sensor keeps a small ring
+# buffer of its recent readings, so a reading costs O(1) work per rule whatever the history.
+# An alert is emitted when a rule starts firing for a sensor, and again only after the
+# sensor has recovered, so a burning unit does not flood the sink.
+class AlertEngine:
+    def __init__(self, registry, rules, sink, capacity=WINDOW_CAPACITY):
+        self.rules = rules
+        self.sink = sink
+        self.capacity = capacity
+        self.window = max(rule.window for rule in rules)
+        self.windows = {}
+        self.active = set()
+        self.lock = threading.Lock()
+        self.latency = LatencyStats(LATENCY_SAMPLES)
+        self.readings = 0
+        self.alerts = 0
+        self.use_registry(registry)
+
+    # Function to switch to a newer registry, keeping the readings seen so far
+    def use_registry(self, registry):
+        self.registry = registry
+        self.neighbors = sensor_neighbors(registry)
+
+    def latest_temperature(self, sensorid):
+        window = self.windows.get(sensorid)
+        if window is None or window.count == 0:
+            return -math.inf
+        return window.latest()[1]
+
+    # Function to evaluate one reading, returning the alerts it raised. received_at is the
+    # time.perf_counter() at which the app learnt of the reading (the NOTIFY of its batch), to
+    # measure the alert latency. Readings older than a sensor's latest one are ignored, so
+    # re-reading rows is harmless.
+    def process(self, sensorid, temperature, date, received_at=None):
+        received_at = time.perf_counter() if received_at is None else received_at
+        if temperature is None or math.isnan(temperature):
+            return []
+        reading_time = pd.Timestamp(date).timestamp()
+
+        raised = []
+        with self.lock:
+            window = self.windows.get(sensorid)
+            if window is None:
+                window = self.windows[sensorid] = SensorWindow(self.capacity)
+            elif window.count and reading_time <= window.latest()[0]:
+                return []
+            window.append(reading_time, temperature)
+            window.expire(reading_time - self.window)
+            self.readings += 1
+
+            for rule in self.rules:
+                message = rule.evaluate(self, sensorid, window)
+                key = (rule.name, sensorid)
+                if message is None:
+                    self.active.discard(key)
+                elif key not in self.active:
+                    self.active.add(key)
+                    raised.append(self.alert(rule, sensorid, temperature, date, message))
+            self.alerts += len(raised)
+
+        for alert in raised:
+            latency = time.perf_counter() - received_at
+            self.latency.record(latency)
+            alert['latency_ms'] = round(latency * 1000, 3)
+            self.sink.emit(alert)
+        return raised
+
+    # Function to evaluate a batch of readings with sensorid, temperature and date columns, oldest first
+    def process_readings(self, readings_df, received_at=None):
+        received_at = time.perf_counter() if received_at is None else received_at
+        raised = []
+        for sensorid, temperature, date in zip(readings_df['sensorid'], readings_df['temperature'], readings_df['date']):
+            # A NULL temperature comes back as None or NaN depending on the rest of the column
+            if temperature is None or pd.isna(temperature):
+                continue
+            raised.extend(self.process(sensorid, float(temperature), date, received_at))
+        return raised
+
+    def alert(self, rule, sensorid, temperature, date, message):
+        block = self.registry.sensor_blocks.get(sensorid)
+        label = self.registry.labels.get(sensorid, f'Sensor: {sensorid}')
+        return {
+            'rule': rule.name,
+            'sensorid': sensorid,
+            'block': block,
+            'unit': label,
+            'temperature': temperature,
+            'date': pd.Timestamp(date).isoformat(),
+            'message': f'Block {block}, {label}: {message}',
+            # Seconds between the reading being taken and the alert, including ingest and database delays
+            'reading_age_s': round((data_now() - pd.Timestamp(date)).total_seconds(), 3),
+        }
+
+    def stats(self):
+        return {'readings': self.readings, 'alerts': self.alerts, 'latency': self.latency.report()}
+
+
+#-------------------------- Sinks --------------------------#
+# A sink receives every alert as a dict through emit(alert)
+
+class LogSink:
+    def __init__(self, logger_name=__name__):
+        self.logger = logging.getLogger(logger_name)
+
+    def emit(self, alert):
+        self.logger.warning('ALERT %s', alert['message'])
+
+
+# Appends every alert to a file as one JSON object per line
+class FileSink:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def emit(self, alert):
+        line = json.dumps(alert, default=str)
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as alert_file:
+                alert_file.write(line + '\n')
+
+
+# Function to pick the sink from ALERT_FILE, logging the alerts when it is not set
+def default_sink(path=None):
+    path = path or os.environ.get('ALERT_FILE')
+    return FileSink(path) if path else LogSink()
+
+
+#-------------------------- Database feed --------------------------#
+# Readings of the registered sensors after the (date, sensorid) of the last reading read
+new_readings_query = '''
+    SELECT
+        sensorid, temperature, date
+    FROM
+        data
+    WHERE
+        (date, sensorid) > (%(date)s, %(sensorid)s) AND
+        sensorid = ANY(%(sensor_ids)s)
+    ORDER BY
+        date, sensorid
+'''
+new_readings_statement = PreparedStatement('new_readings', new_readings_query)
+
+# Feeds the engine the readings of the registered sensors as they are committed to the data
+# table. Each poll reads only the rows after the watermark, the (date, sensorid) of the last
+# row read, so a poll costs the new readings rather than a window of every sensor's history.
+class ReadingFeed:
+    def __init__(self, engine):
+        self.engine = engine
+        self.watermark = (data_now().to_pydatetime(), '')
+
+    # Function to evaluate the new readings, received_at being when the app learnt of them
+    def poll(self, received_at):
+        params = {'date': self.watermark[0], 'sensorid': self.watermark[1], 'sensor_ids': self.engine.registry.sensor_ids}
+        with pool.connection() as connection:
+            readings_df = new_readings_statement.read(connection, params, parse_dates=['date'])
+        if len(readings_df):
+            self.watermark = (readings_df['date'].iloc[-1].to_pydatetime(), readings_df['sensorid'].iloc[-1])
+        return self.engine.process_readings(readings_df, received_at)
+
+
+def watch(sink):
+    logger = logging.getLogger(__name__)
+    engine = AlertEngine(get_registry(), default_rules(), sink)
+    feed = ReadingFeed(engine)
+    wait = NotificationListener(connection_settings, 'sensor_readings', timeout=FEED_RETRY_DELAY)
+    reported_at = time.monotonic()
+    while True:
+        try:
+            wait()
+            # Latencies count from the NOTIFY of the new readings, so they include the query
+            received_at = time.perf_counter()
+            registry = get_registry()
+            if registry is not engine.registry:
+                engine.use_registry(registry)
+            feed.poll(received_at)
+        except Exception:
+            logger.exception('Alert feed failed, retrying')
+            time.sleep(FEED_RETRY_DELAY)
+        if time.monotonic() - reported_at >= REPORT_INTERVAL:
+            logger.info('Alert engine %s', json.dumps(engine.stats()))
+            reported_at = time.monotonic()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate the fire alert rules on every new reading')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    watch_parser = subparsers.add_parser('watch', help='follow the data table and emit alerts as readings arrive')
+    watch_parser.add_argument('--file', help='append alerts to this file as JSON lines (default: ALERT_FILE, else log them)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    watch(default_sink(args.file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+### This file contains the per-block summary of the latest readings behind the block overview page
+
+
+# Per-block summary of a snapshot of readings, computed in one vectorized pass over
+# every registered sensor. The registry rows are sorted by block, so each block is a
+# contiguous run and the max, hottest unit and count over threshold of all blocks
+# come out of a few NumPy reductions instead of one query or groupby per block.
+class BlockSummary:
+    def __init__(self, registry_df):
+        registry_df = registry_df.sort_values(by=['block', 'level', 'unit'], ignore_index=True)
+        self.sensor_index = pd.Index(registry_df['sensorid'])
+        self.levels = registry_df['level'].values
+        self.units = registry_df['unit'].values
+        blocks = registry_df['block'].values
+        self.starts = np.flatnonzero(np.r_[True, blocks[1:] != blocks[:-1]]) if len(blocks) else np.array([], dtype=int)
+        self.ends = np.r_[self.starts[1:], len(blocks)]
+        self.blocks = blocks[self.starts]
+        self.codes = np.repeat(np.arange(len(self.starts)), self.ends - self.starts)
+
+    # Function to return one row per block with its max temperature, the level and unit of its
+    # hottest sensor and the number of sensors at or over the threshold, hottest blocks first.
+    # Blocks without any reading yet have no max temperature and sort last.
+    def summarize(self, readings_df, threshold):
+        if len(self.starts) == 0:
+            return pd.DataFrame(columns=['block', 'max_temperature', 'level', 'unit', 'units_over_threshold'])
+
+        temperatures = np.full(len(self.sensor_index), -np.inf)
+        positions = self.sensor_index.get_indexer(readings_df['sensorid'])
+        known = positions >= 0
+        temperatures[positions[known]] = readings_df['temperature'].values[known]
+        temperatures[np.isnan(temperatures)] = -np.inf
+
+        # Sorting by (block, temperature) puts every block's hottest sensor at the end of its run
+        hottest = np.lexsort((temperatures, self.codes))[self.ends - 1]
+        max_temperatures = temperatures[hottest]
+        reported = np.isfinite(max_temperatures)
+        summary_df = pd.DataFrame({
+            'block': self.blocks,
+            'max_temperature': np.where(reported, max_temperatures, np.nan),
+            'level': np.where(reported, self.levels[hottest], None),
+            'unit': np.where(reported, self.units[hottest], None),
+            'units_over_threshold': np.add.reduceat((temperatures >= threshold).astype(int), self.starts),
+        })
+        return summary_df.sort_values(by=['max_temperature', 'block'], ascending=[False, True], na_position='last', ignore_index=True)
@@ -0,0 +1,62 @@
+import threading
+import time
+from collections import OrderedDict
+
+from pages.database import data_now
+
+### This file contains the in-memory result cache used for historical queries
+
+
+# Seconds a result covering the present stays valid, new readings may still land in it
+LIVE_TTL = 10
+
+
+# Function to pick how long a result ending at `end` may be cached: ranges entirely
+# in the past never change and never expire, ranges touching now get a short TTL
+def ttl_for_range(end):
+    return None if end <= data_now() else LIVE_TTL
+
+
+# Size-bounded LRU cache whose entries may carry an expiry time
+class ResultCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or time.monotonic() < expires_at:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value, ttl=None):
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    # Function to return the cached value of key, computing and storing it on a miss.
+    # ttl may be a number of seconds, None for no expiry, or a function of the value.
+    def get_or_compute(self, key, compute, ttl=None):
+        found, value = self.get(key)
+        if found:
+            return value
+        value = compute()
+        self.put(key, value, ttl(value) if callable(ttl) else ttl)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
@@ -26,7 +26,8 @@ nav_buttons = dbc.Row(
             html.Div(
                 [
                     dbc.Button("Live Heatmap", className="me-md-2", color='danger', id='live-heatmap-button1', href="/live-heatmap"),
-                    dbc.Button("Historical Data", className="me-md-2", color='danger', id='historical-data-button1', href="/historical-data")
+                    dbc.Button("Historical Data", className="me-md-2", color='danger', id='historical-data-button1', href="/historical-data"),
+                    dbc.Button("Block Overview", className="me-md-2", color='danger', id='block-overview-button1', href="/block-overview")
                 ],
                 className="d-grid gap-2 d-md-flex justify-content-md-end"
             )
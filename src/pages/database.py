@@ -0,0 +1,187 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+from pages.metrics import observe_query
+from pages.prepared import PreparingConnection
+
+### This file contains the PostgreSQL connection pool shared by every page
+
+
+# Connection settings, each one can be overridden through an environment variable
+connection_settings = dict(
+    user=os.environ.get('DB_USER', 'dbfirenet_user'),
+    password=os.environ.get('DB_PASSWORD', 'G9Fw38n8WjMfN4zTBydkxYqZFefZSiM4'),
+    host=os.environ.get('DB_HOST', 'dpg-ck0lntu3ktkc73f98tcg-a.singapore-postgres.render.com'),
+    port=os.environ.get('DB_PORT', '5432'),
+    database=os.environ.get('DB_NAME', 'dbfirenet'),
+    connect_timeout=int(os.environ.get('DB_CONNECT_TIMEOUT', 10)),
+)
+
+# Timezone of the naive timestamps stored in the date column
+DATA_TIMEZONE = os.environ.get('DATA_TIMEZONE', 'Asia/Singapore')
+
+# Pool sizing. Every gunicorn worker process gets its own pool and DB_POOL_MAX_SIZE bounds
+# its concurrent queries (with thread workers, match it to --threads). Callbacks beyond
+# that wait for a free connection.
+POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 4))
+# Seconds a callback waits for a free connection before giving up
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+# Connections idle for longer than this many seconds are pinged before being handed out
+POOL_CHECK_AFTER = float(os.environ.get('DB_POOL_CHECK_AFTER', 30))
+
+
+# Function to return the current time in the same (naive) form as the date column
+def data_now():
+    return pd.Timestamp.now(tz=DATA_TIMEZONE).tz_localize(None)
+
+
+# Cursor counting and timing its statements for the callback instrumentation (pages/metrics.py)
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        with observe_query():
+            return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        with observe_query():
+            return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        with observe_query():
+            return super().copy_expert(sql, file, size)
+
+
+# Raised when no connection could be checked out within the pool timeout
+class PoolTimeout(psycopg2.pool.PoolError):
+    pass
+
+
+# Thread-safe connection pool with checkout timeouts and liveness checks on borrow.
+# Dead connections are dropped and replaced with fresh ones, so a dropped TCP
+# connection only costs one failed callback instead of breaking the page.
+# The first min_size connections are opened in the background, so creating the pool
+# never waits on the database and the app starts even when it is down.
+class ConnectionPool:
+    def __init__(self, min_size, max_size, timeout, check_after, **settings):
+        self.timeout = timeout
+        self.check_after = check_after
+        self.settings = settings
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+        # Idle connections as (connection, returned_at) pairs, most recently used last
+        self.idle = []
+        if min_size:
+            threading.Thread(target=self.warm, args=(min_size,), daemon=True).start()
+
+    # Function to open idle connections ahead of the first callbacks, giving up quietly
+    # when the database cannot be reached (connections are then opened on demand)
+    def warm(self, count):
+        for _ in range(count):
+            try:
+                connection = self.connect()
+            except psycopg2.Error as error:
+                logging.getLogger(__name__).warning('Could not open a database connection ahead of use: %s', error)
+                return
+            with self.lock:
+                self.idle.append((connection, time.monotonic()))
+
+    def connect(self):
+        return psycopg2.connect(connection_factory=PreparingConnection, cursor_factory=InstrumentedCursor, **self.settings)
+
+    def is_alive(self, connection):
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f'No database connection became available within {self.timeout}s')
+        try:
+            with self.lock:
+                connection, returned_at = self.idle.pop() if self.idle else (None, None)
+            if connection is not None and time.monotonic() - returned_at > self.check_after and not self.is_alive(connection):
+                self.discard(connection)
+                connection = None
+            if connection is None or connection.closed:
+                connection = self.connect()
+            return connection
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, connection, broken=False):
+        try:
+            if not broken and not connection.closed:
+                # Leaving no transaction open, so the next borrower starts clean
+                if connection.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                with self.lock:
+                    self.idle.append((connection, time.monotonic()))
+            else:
+                self.discard(connection)
+        except psycopg2.Error:
+            self.discard(connection)
+        finally:
+            self.slots.release()
+
+    # Context manager lending a connection for the duration of a with block
+    @contextmanager
+    def connection(self):
+        connection = self.getconn()
+        broken = False
+        try:
+            yield connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(connection, broken)
+
+    def closeall(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection, _ in idle:
+            self.discard(connection)
+
+
+#-------------------------- Initialization --------------------------#
+pool = ConnectionPool(POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_TIMEOUT, POOL_CHECK_AFTER, **connection_settings)
+
+
+# Check for a table created by the setup step (pages/setup.py), the pages use slower queries
+# until it exists. A missing table is looked for again at most every `interval` seconds,
+# a found one is not checked again
+class TableCheck:
+    def __init__(self, table, interval=60):
+        self.table = table
+        self.interval = interval
+        self.exists = False
+        self.checked_at = -interval
+
+    def __call__(self, connection):
+        if not self.exists and time.monotonic() - self.checked_at >= self.interval:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT to_regclass(%s)", (self.table,))
+                self.exists = cursor.fetchone()[0] is not None
+            self.checked_at = time.monotonic()
+        return self.exists
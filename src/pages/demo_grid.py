@@ -0,0 +1,288 @@
+import mmap
+import os
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+### This file contains the shared heatmap grid the demo generator writes and the demo page reads
+
+
+# Name of the shared memory block the demo generator publishes its grid in
+DEMO_SHM_NAME = os.environ.get('DEMO_SHM_NAME', 'firenet_demo_heatmap')
+
+# Snapshot file the demo generator can publish its grid in instead, for readers that cannot
+# share memory with it (another container, another host on a shared volume)
+DEMO_SNAPSHOT_FILE = os.environ.get('DEMO_SNAPSHOT_FILE')
+
+# Header: sequence number, levels, units
+HEADER_DTYPE = np.dtype([('sequence', np.uint64), ('levels', np.uint32), ('units', np.uint32)])
+
+# Header of a snapshot file: magic, format version, sequence number, unix timestamp, levels,
+# units. The temperatures follow as float32, row by row.
+SNAPSHOT_MAGIC = b'FNHM'
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_DTYPE = np.dtype([
+    ('magic', 'S4'), ('format', '<u4'), ('sequence', '<u8'), ('timestamp', '<f8'), ('levels', '<u4'), ('units', '<u4')
+])
+
+
+# Heatmap grid of a (levels x units) building laid out in a flat buffer: a small header
+# followed by the temperatures as float64. Writes follow a sequence lock: the sequence is
+# odd while the grid is being written and even once it is complete, so a reader that saw
+# the same even sequence before and after copying the grid holds a consistent snapshot,
+# without any locking between processes.
+class DemoGrid:
+    def __init__(self, buffer, shm=None):
+        self.shm = shm
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=buffer)
+        self.shape = (int(self.header['levels']), int(self.header['units']))
+        self.grid = np.ndarray(self.shape, dtype=np.float64, buffer=buffer, offset=HEADER_DTYPE.itemsize)
+
+    @staticmethod
+    def size(levels, units):
+        return HEADER_DTYPE.itemsize + levels * units * np.dtype(np.float64).itemsize
+
+    @staticmethod
+    def initialize(buffer, levels, units):
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=buffer)
+        header['sequence'], header['levels'], header['units'] = 0, levels, units
+
+    # Function to create a grid in a new shared memory block. A block of the same name raises
+    # FileExistsError, as it may belong to a running generator, unless replace is set
+    @classmethod
+    def create_shared(cls, levels, units, name=DEMO_SHM_NAME, replace=False):
+        if replace:
+            try:
+                stale = shared_memory.SharedMemory(name=name)
+                stale.close()
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+        shm = shared_memory.SharedMemory(name=name, create=True, size=cls.size(levels, units))
+        cls.initialize(shm.buf, levels, units)
+        return cls(shm.buf, shm)
+
+    # Function to attach to the grid published by the generator, None when it is not running
+    @classmethod
+    def attach(cls, name=DEMO_SHM_NAME):
+        try:
+            shm = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return None
+        # Readers must not unlink the generator's block when they exit
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm.buf, shm)
+
+    # Function to create a grid private to this process
+    @classmethod
+    def create_local(cls, levels, units):
+        buffer = bytearray(cls.size(levels, units))
+        cls.initialize(buffer, levels, units)
+        return cls(buffer)
+
+    def write(self, temperatures):
+        sequence = int(self.header['sequence'])
+        self.header['sequence'] = sequence + 1
+        self.grid[:] = temperatures
+        self.header['sequence'] = sequence + 2
+
+    # Function to return (sequence, copy of the grid) of the last complete write, (0, None)
+    # when nothing has been written yet or the writer never finished a write it started
+    def read(self, attempts=1000):
+        for _ in range(attempts):
+            before = int(self.header['sequence'])
+            if before == 0:
+                break
+            if before % 2:
+                time.sleep(0)
+                continue
+            temperatures = self.grid.copy()
+            if int(self.header['sequence']) == before:
+                return before, temperatures
+        return 0, None
+
+    def close(self, unlink=False):
+        if self.shm is not None:
+            # The numpy views must go before the memory block can be closed
+            del self.header, self.grid
+            self.shm.close()
+            if unlink:
+                self.shm.unlink()
+
+
+# Function to replace the file at path with the given chunks of bytes. They are written to a
+# temporary file in the same directory which is then renamed over path, so readers see either
+# the previous file or the complete new one, never a partly written file.
+def write_atomically(path, chunks):
+    directory, name = os.path.split(os.path.abspath(path))
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, prefix=f'.{name}.')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+# Function to publish a (levels x units) grid of temperatures in a snapshot file
+def write_snapshot(path, sequence, temperatures):
+    temperatures = np.asarray(temperatures, dtype='<f4')
+    header = np.zeros((), dtype=SNAPSHOT_DTYPE)
+    header['magic'], header['format'], header['sequence'], header['timestamp'] = SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, sequence, time.time()
+    header['levels'], header['units'] = temperatures.shape
+    write_atomically(path, [header.tobytes(), temperatures.tobytes()])
+
+
+# Reader of a snapshot file. The file is memory mapped and the grid returned is a read-only
+# view of the mapping, so reading costs no parsing and no copy. Snapshot files are only ever
+# replaced, never written in place, so a view stays valid and unchanged for as long as it is
+# held, even after the generator has renamed newer snapshots over the path. The file is only
+# mapped again when its inode, size or modification time changed, and the grid is only
+# rebuilt when the sequence in its header did.
+class SnapshotFile:
+    def __init__(self, path):
+        self.path = path
+        self.file_key = None
+        self.sequence = 0
+        self.timestamp = None
+        self.temperatures = None
+
+    # Function to open the snapshot file at path, None when there is none
+    @classmethod
+    def open(cls, path):
+        if path is None or not os.path.exists(path):
+            return None
+        return cls(path)
+
+    def load(self):
+        with open(self.path, 'rb') as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(mapping) < SNAPSHOT_DTYPE.itemsize:
+            raise ValueError(f'{self.path} is not a heatmap snapshot')
+        header = np.frombuffer(mapping, dtype=SNAPSHOT_DTYPE, count=1)[0]
+        if header['magic'] != SNAPSHOT_MAGIC or header['format'] != SNAPSHOT_FORMAT:
+            raise ValueError(f'{self.path} is not a version {SNAPSHOT_FORMAT} heatmap snapshot')
+        if int(header['sequence']) == self.sequence:
+            return
+        shape = (int(header['levels']), int(header['units']))
+        self.temperatures = np.frombuffer(
+            mapping, dtype='<f4', count=shape[0] * shape[1], offset=SNAPSHOT_DTYPE.itemsize
+        ).reshape(shape)
+        self.sequence, self.timestamp = int(header['sequence']), float(header['timestamp'])
+
+    # Function to return (sequence, grid) of the latest snapshot, (0, None) before the first one
+    def read(self):
+        try:
+            status = os.stat(self.path)
+        except FileNotFoundError:
+            return self.sequence, self.temperatures
+        file_key = (status.st_ino, status.st_size, status.st_mtime_ns)
+        if file_key != self.file_key:
+            self.load()
+            self.file_key = file_key
+        return self.sequence, self.temperatures
+
+    def close(self, unlink=False):
+        # The mapping is released with the last view of it
+        self.temperatures = None
+
+
+# Thread regenerating a grid every interval with generate(), the in-process stand-in
+# for the demo generator when it is not running
+class DemoProducer:
+    def __init__(self, grid, generate, interval):
+        self.grid = grid
+        self.generate = generate
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.grid.write(self.generate())
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.grid.write(self.generate())
+
+    def stop(self):
+        self.stopped.set()
+
+
+# Source of the demo heatmap. It reads the grid the demo generator publishes in shared
+# memory or, failing that, in a snapshot file, and while the generator is not running it
+# falls back to a DemoProducer in this process. A published grid whose sequence has not
+# moved for stale_after seconds belongs to a generator that stopped or restarted, so the
+# source looks for the generator's grid again.
+class DemoSource:
+    def __init__(self, levels, units, generate, interval, stale_after=5, name=DEMO_SHM_NAME, snapshot_path=DEMO_SNAPSHOT_FILE):
+        self.levels = levels
+        self.units = units
+        self.generate = generate
+        self.interval = interval
+        self.stale_after = stale_after
+        self.name = name
+        self.snapshot_path = snapshot_path
+        self.lock = threading.Lock()
+        self.grid = None
+        self.producer = None
+        self.sequence = None
+        self.changed_at = None
+        self.abandoned = None
+        # Counts the grids read from, a new grid's sequence starts over
+        self.generation = 0
+
+    # Function to return the grid the demo generator publishes, None while it is not running
+    def published(self):
+        for open_grid in (lambda: DemoGrid.attach(self.name), lambda: SnapshotFile.open(self.snapshot_path)):
+            grid = None
+            try:
+                grid = open_grid()
+                if grid is not None and grid.read()[0] not in (0, self.abandoned):
+                    return grid
+            except ValueError:
+                pass
+            if grid is not None:
+                grid.close()
+        return None
+
+    def resolve(self):
+        if self.producer is None and self.stale():
+            # The generator stopped, its grid is not used again until the sequence moves
+            self.abandoned = self.sequence
+        published = self.published()
+        if published is not None:
+            if self.producer is not None:
+                self.producer.stop()
+                self.producer = None
+            if self.grid is not None:
+                self.grid.close()
+            self.grid, self.sequence, self.changed_at = published, None, time.monotonic()
+            self.generation += 1
+        elif self.grid is None or (self.producer is None and self.stale()):
+            if self.grid is not None:
+                self.grid.close()
+            self.grid = DemoGrid.create_local(self.levels, self.units)
+            self.producer = DemoProducer(self.grid, self.generate, self.interval).start()
+            self.sequence = None
+            self.generation += 1
+
+    def stale(self):
+        return self.changed_at is not None and time.monotonic() - self.changed_at > self.stale_after
+
+    # Function to return (generation, sequence, copy of the grid) of the latest demo heatmap.
+    # The sequence only identifies a heatmap together with the generation of the grid it came from
+    def read(self):
+        with self.lock:
+            if self.grid is None or self.producer is not None or self.stale():
+                self.resolve()
+            sequence, temperatures = self.grid.read()
+            if temperatures is not None and sequence != self.sequence:
+                self.sequence, self.changed_at = sequence, time.monotonic()
+            return self.generation, sequence, temperatures
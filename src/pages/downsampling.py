@@ -0,0 +1,28 @@
+import numpy as np
+
+### This file contains the downsampling used to keep graph payloads small
+
+
+# Function to reduce a series to at most max_points samples while keeping its peaks.
+# The samples are split into equal-sized buckets and every bucket keeps its lowest
+# and highest sample in time order, so spikes survive however long the range is.
+def minmax_downsample(x, y, max_points):
+    if max_points < 2:
+        raise ValueError(f'max_points must be at least 2 (a minimum and a maximum per bucket), got {max_points}')
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    if len(y) <= max_points:
+        return x, y
+
+    # Padding the tail with NaN so the samples reshape into (buckets, bucket_size)
+    bucket_size = -(-len(y) // (max_points // 2))
+    buckets = -(-len(y) // bucket_size)
+    padded = np.full(buckets * bucket_size, np.nan)
+    padded[:len(y)] = y
+    padded = padded.reshape(buckets, bucket_size)
+
+    offsets = np.arange(buckets) * bucket_size
+    lowest = offsets + np.nanargmin(padded, axis=1)
+    highest = offsets + np.nanargmax(padded, axis=1)
+    keep = np.unique(np.concatenate([lowest, highest]))
+    return x[keep], y[keep]
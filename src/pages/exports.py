@@ -0,0 +1,165 @@
+import csv
+import io
+import threading
+import uuid
+from urllib.parse import urlencode
+
+import pandas as pd
+from flask import Blueprint, Response, abort, request, stream_with_context
+
+from pages.database import pool
+from pages.registry import get_registry, knows_block
+
+### This file contains the bulk export of raw readings, streamed as CSV or Parquet
+###     GET /exports/<block>.csv?start=2023-09-01T00:00&end=2023-10-01T00:00[&sensors=42261f3,422607c]
+
+
+# Rows fetched from the server-side cursor and written out per chunk
+EXPORT_CHUNK_ROWS = 10000
+# Downloads running at once per worker. Each holds a pooled connection until it finishes,
+# so this leaves the rest of the pool to the page callbacks
+EXPORT_MAX_CONCURRENT = 1
+
+export_columns = ['date', 'sensorid', 'level', 'unit', 'temperature']
+
+export_query = '''
+    SELECT
+        date, sensorid, level::text, unit::text, temperature::float8
+    FROM
+        data
+    WHERE
+        sensorid = ANY(%(sensor_ids)s) AND
+        date >= %(start)s AND
+        date < %(end)s
+    ORDER BY
+        date, sensorid
+'''
+
+export_routes = Blueprint('exports', __name__)
+export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+
+# Function to build the export URL of a block's sensors over [start, end)
+def export_url(block, file_format, start, end, sensor_ids=None):
+    params = {'start': pd.Timestamp(start).isoformat(), 'end': pd.Timestamp(end).isoformat()}
+    if sensor_ids:
+        params['sensors'] = ','.join(sensor_ids)
+    return f'/exports/{block}.{file_format}?{urlencode(params)}'
+
+# Function to read the requested block, sensors and range from the query string, aborting on bad input
+def export_request(block):
+    if not knows_block(block):
+        abort(404, description=f'Unknown block {block}')
+    registry = get_registry()
+    try:
+        start, end = pd.Timestamp(request.args['start']), pd.Timestamp(request.args['end'])
+    except (KeyError, ValueError):
+        abort(400, description='start and end must be given as ISO dates')
+    if start >= end:
+        abort(400, description='start must be before end')
+
+    block_sensor_ids = registry.sensors(block)
+    sensor_ids = request.args.get('sensors')
+    sensor_ids = [sensorid for sensorid in sensor_ids.split(',') if sensorid] if sensor_ids else list(block_sensor_ids)
+    if not set(sensor_ids) <= set(block_sensor_ids):
+        abort(400, description=f'sensors must belong to block {block}')
+    return sensor_ids, start, end
+
+# Generator of the export rows in chunks of EXPORT_CHUNK_ROWS. A named cursor keeps the
+# result set on the database server, so memory stays flat however long the range is.
+# The pooled connection is held until the download finishes or the client goes away.
+def export_chunks(sensor_ids, start, end):
+    with pool.connection() as connection:
+        with connection.cursor(name=f'export_{uuid.uuid4().hex}') as cursor:
+            cursor.itersize = EXPORT_CHUNK_ROWS
+            cursor.execute(export_query, {'sensor_ids': sensor_ids, 'start': start, 'end': end})
+            while True:
+                rows = cursor.fetchmany(EXPORT_CHUNK_ROWS)
+                if not rows:
+                    break
+                yield rows
+
+def csv_stream(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_columns)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+# Write-only file the Parquet writer appends to, handing over what was written after every row group
+class ChunkBuffer:
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+# Every chunk becomes one Parquet row group, streamed out as soon as it is written
+def parquet_stream(chunks):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('date', pa.timestamp('us')),
+        ('sensorid', pa.string()),
+        ('level', pa.string()),
+        ('unit', pa.string()),
+        ('temperature', pa.float64()),
+    ])
+    buffer = ChunkBuffer()
+    writer = pq.ParquetWriter(buffer, schema)
+    for rows in chunks:
+        columns = list(zip(*rows))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+        ))
+        yield buffer.take()
+    writer.close()
+    yield buffer.take()
+
+
+export_formats = {
+    'csv': (csv_stream, 'text/csv'),
+    'parquet': (parquet_stream, 'application/vnd.apache.parquet'),
+}
+
+# Raw readings of a block over a date range, as a streamed file download
+@export_routes.route('/exports/<block>.<file_format>')
+def export_readings(block, file_format):
+    if file_format not in export_formats:
+        abort(404)
+    if file_format == 'parquet':
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            abort(501, description='Parquet export needs pyarrow')
+    sensor_ids, start, end = export_request(block)
+    if not export_slots.acquire(blocking=False):
+        abort(503, description='Another export is running, please retry shortly')
+    stream, mimetype = export_formats[file_format]
+    filename = f'block-{block}_{start:%Y%m%d-%H%M}_{end:%Y%m%d-%H%M}.{file_format}'
+    response = Response(
+        stream_with_context(stream(export_chunks(sensor_ids, start, end))),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"', 'X-Accel-Buffering': 'no'}
+    )
+    response.call_on_close(export_slots.release)
+    return response
@@ -1,171 +1,170 @@
-from dash import html, dcc, Output, Input, State, callback_context, register_page, callback
-import plotly.express as px
-import pandas as pd
+from dash import html, dcc, Output, Input, State, register_page, callback, clientside_callback
+import threading
 import dash_bootstrap_components as dbc
-import psycopg2
-
-
-# Function to collect real time temperature data from 6 sensors
-def collect_real_time_data():
-    real_time_query = '''
-        WITH RankedData AS (
-            SELECT
-                sensorid, temperature, date, level, unit,
-                ROW_NUMBER() OVER (PARTITION BY sensorid ORDER BY date DESC) AS row_num
-            FROM 
-                data
-        )
-        SELECT 
-            sensorid, temperature, date, level, unit 
-        FROM 
-            RankedData
-        WHERE 
-            row_num = 1 AND 
-            sensorid IN ('42261f3', '422607c', '42262a', '4226087', '4226222', '42261ea');
-    '''
-    real_time_df = pd.read_sql_query(real_time_query, con=connection)
-    real_time_df = real_time_df.sort_values(by=['level'], ascending=True)
-    real_time_df['level'] = real_time_df['level'].astype(str)
-    
-    # Creating and customizing the heatmap
-    heatmap = px.density_heatmap(
-        real_time_df, 
-        x= "unit", 
-        y= "level", 
-        z="temperature", 
-        range_color=[20, 60], 
-        color_continuous_scale="temps", 
-        text_auto=False, 
-        labels={"unit": "Unit", "level": "Level", "temperature": ""},
-    )
-    heatmap.update_layout(
-        margin=dict(l=0, r=0, t=0, b=0)
-    )
-    heatmap.update_traces(
-        hovertemplate='Unit: %{x} <br>Level: %{y} <br>Temperature: %{z}'
-    )
-    heatmap.update_coloraxes(
-        colorbar_orientation="h",
-        colorbar_title_text="Temperature"
-    )
-    return heatmap
+from dash.exceptions import PreventUpdate
+from pages.database import connection_settings
+from pages.heatmap_grid import heatmap_grid
+from pages.live_data import LatestReadingSnapshot, NotificationListener, SnapshotWatcher, client_version_function, heatmap_update, temperature_cells, temperature_changes, watchers
+from pages.metrics import instrumented
+from pages.registry import LATEST_READINGS_MAX_AGE, available_blocks, get_registry, knows_block, latest_readings
+
+# Seconds the notification listener waits before re-reading the latest readings anyway
+REFRESH_INTERVAL = LATEST_READINGS_MAX_AGE
+# Seconds a block's view of the snapshot is reused, it is cut from the shared snapshot in memory
+BLOCK_REFRESH_INTERVAL = 1
+# Seconds between full heatmap refreshes. Changes are pushed to the browser as they
+# happen (see pages/streams.py), this only resynchronizes the figure now and then
+FALLBACK_REFRESH_INTERVAL = 30
+
+
+# Function to cut one block's readings out of the shared snapshot, one row per registered
+# sensor in the fixed order the heatmap cells are drawn in
+def fetch_block_data(block):
+    return get_registry().block_readings(block, latest_readings.get())
+
+# Function to return the snapshot of a block's readings, None for a block that is not registered
+def block_snapshot(block):
+    if block not in block_snapshots:
+        if not knows_block(block):
+            return None
+        with block_snapshots_lock:
+            if block not in block_snapshots:
+                block_snapshots[block] = LatestReadingSnapshot(
+                    lambda: fetch_block_data(block), max_age=BLOCK_REFRESH_INTERVAL
+                )
+    return block_snapshots[block]
+
+# Function to build the heatmap figure of a block, sized to the levels and units of the block
+def build_block_heatmap(block):
+    registry = get_registry()
+    grid = heatmap_grid(registry.levels(block), registry.units(block))
+    return lambda real_time_df: grid.figure(real_time_df)
 
 
 #-------------------------- Initialization --------------------------#
 register_page(__name__, path="/live-heatmap")
-connection = psycopg2.connect(
-    user="dbfirenet_user", 
-    password="G9Fw38n8WjMfN4zTBydkxYqZFefZSiM4", 
-    host="dpg-ck0lntu3ktkc73f98tcg-a.singapore-postgres.render.com", 
-    port="5432", 
-    database="dbfirenet"
+block_snapshots = {}
+block_snapshots_lock = threading.Lock()
+# One stream per block, every notification re-reads the shared snapshot once for all blocks
+watchers['live-heatmap'] = SnapshotWatcher(
+    NotificationListener(connection_settings, 'sensor_readings', timeout=REFRESH_INTERVAL),
+    block_snapshot,
+    temperature_changes,
+    temperature_cells,
+    refresh=latest_readings.refresh
 )
-cursor = connection.cursor()
-heatmap = collect_real_time_data()
 
 
 #---------------------- Live Heatmap Page Content -----------------------------#
-# Dropdown menu items for block number selection
-heatmap_dropdown_menu_items = [
-    dbc.DropdownMenuItem("Block 123", id="heatmap-dropdown-menu-item-1"),
-    dbc.DropdownMenuItem("Block 124", id="heatmap-dropdown-menu-item-2"),
-    dbc.DropdownMenuItem("Block 125", id="heatmap-dropdown-menu-item-3"),
-    dbc.DropdownMenuItem(divider=True),
-    dbc.DropdownMenuItem("Clear", id="heatmap-dropdown-menu-item-clear"),
-]
-
-# Dropdown menu for block number selection
-live_heatmap_filter_dropdown =  dbc.InputGroup(
-    [
-        dbc.DropdownMenu(heatmap_dropdown_menu_items, label="Select"),
-        dbc.Input(id="heatmap-input-group-dropdown-input", placeholder="Block Number", disabled=True),
-    ],
-    size="sm"
-)
-
-# Callback function for dropdown menu
-@callback(
-    Output("heatmap-input-group-dropdown-input", "value"),
-    [
-        Input("heatmap-dropdown-menu-item-1", "n_clicks"),
-        Input("heatmap-dropdown-menu-item-2", "n_clicks"),
-        Input("heatmap-dropdown-menu-item-3", "n_clicks"),
-        Input("heatmap-dropdown-menu-item-clear", "n_clicks"),
-    ],
-)
-def on_button_click(n1, n2, n3, n_clear):
-    if not callback_context.triggered:
-        return ""
-    else:
-        button_id = callback_context.triggered[0]["prop_id"].split(".")[0]
-
-    if button_id == "heatmap-dropdown-menu-item-clear":
-        return ""
-    elif button_id == "heatmap-dropdown-menu-item-1":
-        return "Block 123"
-    elif button_id == "heatmap-dropdown-menu-item-2":
-        return "Block 124"
-    else:
-        return "Block 125"
+# Searchable dropdown of the registered building blocks
+def live_heatmap_filter_dropdown():
+    return dcc.Dropdown(
+        id="heatmap-block-select",
+        options=[{'label': f'Block {block}', 'value': block} for block in available_blocks()],
+        placeholder="Block Number",
+        searchable=True,
+        clearable=True,
+    )
 
 # Live heatmap block number selector layout
-live_heatmap_filter = dbc.Card(
-    dbc.CardBody(
-        [
-            html.H5("Select building block number", className="card-title"),
-            live_heatmap_filter_dropdown,
-            dbc.Button("Check now", color="danger", id="open-live-heatmap-modal", style={"margin-top": "10px"})
-        ]
+def live_heatmap_filter():
+    return dbc.Card(
+        dbc.CardBody(
+            [
+                html.H5("Select building block number", className="card-title"),
+                live_heatmap_filter_dropdown(),
+                dbc.Button("Check now", color="danger", id="open-live-heatmap-modal", style={"margin-top": "10px"})
+            ]
+        )
+    )
+
+# Live heatmap graph layout of a block
+def live_heatmap_graph(block):
+    snapshot = block_snapshot(block)
+    data, version = snapshot.current()
+    return dbc.Card(
+        dbc.CardBody(
+            [
+                html.H5("Live Heatmap", className="card-title"),
+                html.P(
+                    f"For Block {block}"
+                ),
+                # Graphs inside a data-stream container receive pushed updates from assets/live_stream.js
+                html.Div(
+                    dcc.Graph(
+                        id='block-heatmap',
+                        figure=build_block_heatmap(block)(data),
+                        config={'displayModeBar': False}
+                    ),
+                    id='heatmap-stream',
+                    **{'data-stream': f'live-heatmap/{block}'}
+                ),
+                # Version of the readings the last refresh sent, so refreshes only send what changed
+                dcc.Store(id='heatmap-version', data=version),
+                # Version the client's heatmap shows once pushed changes are counted in, sent with every refresh
+                dcc.Store(id='heatmap-client-version'),
+                dcc.Interval(
+                    id='interval-component',
+                    interval=FALLBACK_REFRESH_INTERVAL*1000, # in milliseconds
+                    n_intervals=0
+                )
+            ]
+        )
     )
-)
 
-# Live heatmap graph layout
-live_heatmap_graph = dbc.Card(
-    dbc.CardBody(
+#---------------------- Live heatmap page layout --------------------------#
+# Built on every page load so newly registered blocks show up in the dropdown
+def layout():
+    return dbc.Row(
         [
-            html.H5("Live Heatmap", className="card-title"),
-            html.P(
-                "For Block 123"
-            ),
-            dcc.Graph(
-                id='block-heatmap',
-                figure=heatmap,
-                config={'displayModeBar': False}
-            ),
-            dcc.Interval(
-                id='interval-component',
-                interval=5*1000, # in milliseconds
-                n_intervals=0
+            dbc.Col(live_heatmap_filter(), width="3px"),
+            dbc.Modal(
+                [
+                    dbc.ModalHeader(dbc.ModalTitle("Live Heatmap")),
+                    dbc.ModalBody(dbc.Col(id="heatmap-card")),
+                ],
+                id="live-heatmap-modal",
+                fullscreen=True,
             )
         ]
     )
-)
-
-#---------------------- Live heatmap page layout --------------------------#
-layout = dbc.Row(
-    [
-        dbc.Col(live_heatmap_filter, width="3px"),
-        dbc.Modal(
-            [
-                dbc.ModalHeader(dbc.ModalTitle("Live Heatmap")),
-                dbc.ModalBody(dbc.Col(id="heatmap-card", children=live_heatmap_graph)),
-            ],
-            id="live-heatmap-modal",
-            fullscreen=True,
-        )
-    ]
-)
 
 
 #---------------------- Callback Functions --------------------------#
+# Clientside callback taking the version the heatmap shows into account on every refresh tick
+clientside_callback(
+    client_version_function,
+    Output('heatmap-client-version', 'data'),
+    Input('interval-component', 'n_intervals'),
+    State('heatmap-version', 'data'),
+    State('heatmap-version', 'modified_timestamp'),
+    State('heatmap-stream', 'data-stream'),
+)
+
 # Callback function to update the live heatmap graph periodically
 @callback(
     Output('block-heatmap', 'figure'),
-    Input('interval-component', 'n_intervals')
+    Output('heatmap-version', 'data'),
+    Input('heatmap-client-version', 'data'),
+    State('heatmap-block-select', 'value'),
+)
+@instrumented('live-heatmap.update_heatmap')
+def update_heatmap(client, block):
+    snapshot = block_snapshot(block)
+    if snapshot is None or client is None:
+        raise PreventUpdate
+    return heatmap_update(snapshot, client['version'], build_block_heatmap(block))
+
+# Callback function to draw the live heatmap of the selected block
+@callback(
+    Output("heatmap-card", "children"),
+    Input("heatmap-block-select", "value"),
 )
-def update_heatmap(n_intervals):
-    heatmap = collect_real_time_data()
-    return heatmap
+@instrumented('live-heatmap.show_block_heatmap')
+def show_block_heatmap(block):
+    if block is None or block_snapshot(block) is None:
+        return None
+    return live_heatmap_graph(block)
 
 # Callback function to expand live heatmap graph after block number is selected
 @callback(
@@ -173,6 +172,7 @@ def update_heatmap(n_intervals):
     Input("open-live-heatmap-modal", "n_clicks"),
     State("live-heatmap-modal", "is_open"),
 )
+@instrumented('live-heatmap.toggle_modal')
 def toggle_modal(n, is_open):
     if n:
         return not is_open
@@ -181,10 +181,11 @@ def toggle_modal(n, is_open):
 # Callback function to allow access to only to buildings affected by fire
 @callback(
     Output("open-live-heatmap-modal", "disabled"),
-    Input("heatmap-input-group-dropdown-input", "value")
+    Input("heatmap-block-select", "value")
 )
-def show_heatmap(block_number):
-    if block_number == "Block 123":
+@instrumented('live-heatmap.show_heatmap')
+def show_heatmap(block):
+    if block is not None and knows_block(block):
         return False
     else:
         return True
@@ -1,38 +1,71 @@
-from dash import html, dcc, Output, Input, State, callback_context, register_page, callback
-import plotly.express as px
-import pandas as pd
+from dash import html, dcc, Output, Input, State, callback_context, register_page, callback, clientside_callback
 import dash_bootstrap_components as dbc
+from dash.exceptions import PreventUpdate
+import numpy as np
 import pandas as pd
+import time
+from functools import lru_cache
+from pages.demo_grid import DemoSource
+from pages.heatmap_demo_csv_generator import demo_scenario, unit_name
+from pages.heatmap_grid import grid_for_readings
+from pages.live_data import LatestReadingSnapshot, SnapshotWatcher, client_version_function, heatmap_update, temperature_cells, temperature_changes, watchers
+from pages.metrics import instrumented
 
+# Seconds between demo data reads, the demo generator publishes a new heatmap every second
+REFRESH_INTERVAL = 1
+# Seconds between full heatmap refreshes, changes are pushed to the browser as they happen
+FALLBACK_REFRESH_INTERVAL = 30
+# Size of the demo building generated in this process while the demo generator is not running
+DEMO_LEVELS = 10
+DEMO_UNITS = 10
 
-def collect_real_time_data():
-    real_time_df = pd.read_csv('./pages/heatmap_demo_data.csv')
-    real_time_df = real_time_df.sort_values(by=['level'], ascending=True)
-    real_time_df['level'] = real_time_df['level'].astype(str)
-    heatmap = px.density_heatmap(
-        real_time_df, 
-        x= "unit", 
-        y= "level", 
-        z="temperature", 
-        range_color=[20, 60], 
-        color_continuous_scale="temps", 
-        text_auto=False, 
-        labels={"unit": "Unit", "level": "Level", "temperature": ""},
-    )
-    heatmap.update_layout(
-        margin=dict(l=0, r=0, t=0, b=0)
-    )
-    heatmap.update_traces(
-        hovertemplate='Unit: %{x} <br>Level: %{y} <br>Temperature: %{z}'
-    )
-    heatmap.update_coloraxes(
-        colorbar_orientation="h",
-        colorbar_title_text="Temperature"
+
+# Function to return the level and unit columns of a (levels x units) grid flattened row by row
+@lru_cache(maxsize=8)
+def grid_positions(levels, units):
+    return (
+        np.repeat(np.arange(1, levels + 1), units),
+        np.tile(np.array([unit_name(unit) for unit in range(units)], dtype=object), levels),
     )
-    return heatmap
+
+# Function to return the demo readings, the same DataFrame again while the source reads the same
+# grid and its sequence has not moved
+def read_demo_data():
+    global demo_frame
+    generation, sequence, temperatures = demo_source.read()
+    if demo_frame is not None and demo_frame[0] == (generation, sequence):
+        return demo_frame[1]
+    if temperatures is None:
+        return pd.DataFrame({'level': [], 'unit': [], 'temperature': []})
+    levels, units = grid_positions(*temperatures.shape)
+    real_time_df = pd.DataFrame({'level': levels, 'unit': units, 'temperature': temperatures.ravel()})
+    demo_frame = ((generation, sequence), real_time_df)
+    return real_time_df
+
+# Function to build the heatmap figure of a snapshot of readings, sized to its levels and units
+def build_heatmap(real_time_df):
+    return grid_for_readings(real_time_df).figure(real_time_df)
 
 register_page(__name__, path="/demo-heatmap")
-demo_heatmap = collect_real_time_data()
+local_scenario = demo_scenario(DEMO_LEVELS, DEMO_UNITS)
+
+# Function to generate the next heatmap of the demo building in this process, starting the
+# scenario over once its fire has burnt out
+def next_local_heatmap():
+    if local_scenario.finished():
+        local_scenario.restart()
+    return local_scenario.step(REFRESH_INTERVAL)
+
+demo_source = DemoSource(DEMO_LEVELS, DEMO_UNITS, next_local_heatmap, REFRESH_INTERVAL)
+# ((generation, sequence), DataFrame) of the last demo grid read
+demo_frame = None
+demo_snapshot = LatestReadingSnapshot(read_demo_data, max_age=REFRESH_INTERVAL)
+watchers['demo-heatmap'] = SnapshotWatcher(
+    lambda: time.sleep(REFRESH_INTERVAL),
+    lambda topic: demo_snapshot,
+    temperature_changes,
+    temperature_cells
+)
 
 ### Live Heatmap Page Content ###
 # Dropdown menu items for block number selection
@@ -63,6 +96,7 @@ demo_heatmap_filter_dropdown =  dbc.InputGroup(
         Input("demo-heatmap-dropdown-menu-item-clear", "n_clicks"),
     ],
 )
+@instrumented('demo-heatmap.on_button_click')
 def on_button_click(n1, n2, n3, n_clear):
     if not callback_context.triggered:
         return ""
@@ -89,52 +123,76 @@ demo_heatmap_filter = dbc.Card(
     )
 )
 
-# Live heatmap graph layout
-demo_heatmap_graph = dbc.Card(
-    dbc.CardBody(
+# Live heatmap graph layout, read from the demo grid when the page is opened rather than at import
+def demo_heatmap_graph():
+    data, version = demo_snapshot.current()
+    return dbc.Card(
+        dbc.CardBody(
+            [
+                html.H5("Live Heatmap", className="card-title"),
+                html.P(
+                    "For Block 123"
+                ),
+                # Graphs inside a data-stream container receive pushed updates from assets/live_stream.js
+                html.Div(
+                    dcc.Graph(
+                        id='block-demo-heatmap',
+                        figure=build_heatmap(data),
+                        config={'displayModeBar': False}
+                    ),
+                    id='demo-heatmap-stream',
+                    **{'data-stream': 'demo-heatmap'}
+                ),
+                # Version of the readings the last refresh sent, so refreshes only send what changed
+                dcc.Store(id='demo-heatmap-version', data=version),
+                # Version the client's heatmap shows once pushed changes are counted in, sent with every refresh
+                dcc.Store(id='demo-heatmap-client-version'),
+                dcc.Interval(
+                    id='demo-interval-component',
+                    interval=FALLBACK_REFRESH_INTERVAL*1000, # in milliseconds
+                    n_intervals=0
+                )
+            ]
+        )
+    )
+
+# Live heatmap page layout
+def layout():
+    return dbc.Row(
         [
-            html.H5("Live Heatmap", className="card-title"),
-            html.P(
-                "For Block 123"
+            dbc.Col(demo_heatmap_filter, width="3px"),
+            dbc.Modal(
+                [
+                    dbc.ModalHeader(dbc.ModalTitle("Live Heatmap")),
+                    dbc.ModalBody(dbc.Col(id="demo-heatmap-card", children=demo_heatmap_graph())),
+                ],
+                id="live-demo-heatmap-modal",
+                fullscreen=True,
             ),
-            dcc.Graph(
-                id='block-demo-heatmap',
-                figure=demo_heatmap,
-                config={'displayModeBar': False}
-            ),
-            dcc.Interval(
-                id='demo-interval-component',
-                interval=5*1000, # in milliseconds
-                n_intervals=0
-            )
         ]
     )
-)
 
-# Live heatmap page layout
-layout = dbc.Row(
-    [
-        dbc.Col(demo_heatmap_filter, width="3px"),
-        dbc.Modal(
-            [
-                dbc.ModalHeader(dbc.ModalTitle("Live Heatmap")),
-                dbc.ModalBody(dbc.Col(id="demo-heatmap-card", children=demo_heatmap_graph)),
-            ],
-            id="live-demo-heatmap-modal",
-            fullscreen=True,
-        ),
-        
-    ]
+# Clientside callback taking the version the heatmap shows into account on every refresh tick
+clientside_callback(
+    client_version_function,
+    Output('demo-heatmap-client-version', 'data'),
+    Input('demo-interval-component', 'n_intervals'),
+    State('demo-heatmap-version', 'data'),
+    State('demo-heatmap-version', 'modified_timestamp'),
+    State('demo-heatmap-stream', 'data-stream'),
 )
 
 # Callback function to update the live heatmap graph periodically
 @callback(
     Output('block-demo-heatmap', 'figure'),
-    Input('demo-interval-component', 'n_intervals')
+    Output('demo-heatmap-version', 'data'),
+    Input('demo-heatmap-client-version', 'data'),
 )
-def update_heatmap(n_intervals):
-    heatmap = collect_real_time_data()
-    return heatmap
+@instrumented('demo-heatmap.update_heatmap')
+def update_heatmap(client):
+    if client is None:
+        raise PreventUpdate
+    return heatmap_update(demo_snapshot, client['version'], build_heatmap)
 
 # Callback function to expand live heatmap graph after block number is selected
 @callback(
@@ -142,6 +200,7 @@ def update_heatmap(n_intervals):
     Input("open-live-demo-heatmap-modal", "n_clicks"),
     State("live-demo-heatmap-modal", "is_open"),
 )
+@instrumented('demo-heatmap.toggle_modal')
 def toggle_modal(n, is_open):
     if n:
         return not is_open
@@ -152,6 +211,7 @@ def toggle_modal(n, is_open):
     Output("open-live-demo-heatmap-modal", "disabled"),
     Input("demo-heatmap-input-group-dropdown-input", "value")
 )
+@instrumented('demo-heatmap.show_heatmap')
 def show_heatmap(block_number):
     if block_number == "Block 123":
         return False
@@ -1,44 +1,85 @@
+import argparse
 import csv
-import random
+import io
 import time
 
-heatmap = [[None for _ in range(10)] for _ in range(10)]
-heatmap_csv = [[None, None, None] for _ in range(100)]
-heatmap_csv.insert(0, ['level', 'unit', 'temperature'])
+import numpy as np
+
+from pages.demo_grid import DEMO_SHM_NAME, DemoGrid, write_atomically, write_snapshot
+from pages.scenario import MAX_LEVELS, MAX_UNITS, Fire, Scenario, random_fires
 
 unit_letter = {0: 'A', 1: 'B', 2: 'C', 3: 'D', 4: 'E', 5: 'F', 6: 'G', 7: 'H', 8: 'I', 9:'J'}
 
-def hot_temp():
-    return random.randint(50, 53)
-
-def fire_temp():
-    return random.randint(60, 65)
-
-def room_temp():
-    return random.randint(30, 35)
-
-while True:
-    # Generate random temperature data for 10x10 building heatmap
-    for level in range(10):
-        for unit in range(10):
-            if level == 5-1 and (unit >= 1 and unit <= 3):
-                heatmap[level][unit] = fire_temp()
-            elif level == 5-1 and (unit < 1 or unit > 3):
-                heatmap[level][unit] = hot_temp()
-            else:
-                heatmap[level][unit] = room_temp()
-    time.sleep(1)
-    
-    # Generate csv data list
-    n = 0
-    for level in range(10):
-        for unit in range(10):
-            n += 1
-            heatmap_csv[n][0] = level + 1
-            heatmap_csv[n][1] = unit_letter[unit]
-            heatmap_csv[n][2] = heatmap[level][unit]
-
-    # Write csv data into csv file
-    with open('heatmap_demo_data.csv', mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerows(heatmap_csv)
+# Function to name a unit the way the demo heatmap does: A to J, then A1, B1, ... for wider buildings
+def unit_name(unit):
+    return unit_letter[unit % 10] + (str(unit // 10) if unit >= 10 else '')
+
+# Function to return the demo scenario: a (levels x units) building with `fires` fires at
+# random places or, by default, one fire in units B to D of level 5 (or the top level of
+# a lower building)
+def demo_scenario(levels, units, fires=None, seed=None):
+    if fires is None:
+        fire_list = [Fire(min(5, levels), range(1, min(4, units)) if units > 1 else [0])]
+    else:
+        fire_list = random_fires(fires, levels, units, np.random.default_rng(seed))
+    return Scenario(levels, units, fire_list, seed=seed)
+
+
+# Function to flatten a heatmap into the [level, unit, temperature] rows of the demo csv file
+def csv_rows(heatmap):
+    rows = [['level', 'unit', 'temperature']]
+    for level, temperatures in enumerate(heatmap):
+        for unit, temperature in enumerate(temperatures):
+            rows.append([level + 1, unit_name(unit), temperature])
+    return rows
+
+
+# Function to run the demo scenario and publish a heatmap every second in shared memory,
+# where the demo heatmap page reads it. --speed runs the scenario faster than real time and
+# it starts over once its fires have burnt out. --snapshot also publishes the heatmaps in a
+# snapshot file for pages that cannot share memory with the generator, --csv also writes
+# them to a csv file.
+# Run from src: python -m pages.heatmap_demo_csv_generator
+def main():
+    parser = argparse.ArgumentParser(description='Generate demo heatmap data')
+    parser.add_argument('--levels', type=int, default=10, help=f'up to {MAX_LEVELS}')
+    parser.add_argument('--units', type=int, default=10, help=f'up to {MAX_UNITS}')
+    parser.add_argument('--fires', type=int, help='number of fires at random places, instead of the one on level 5')
+    parser.add_argument('--seed', type=int, help='seed of the scenario, the same seed replays the same heatmaps')
+    parser.add_argument('--speed', type=float, default=1, help='scenario seconds per second')
+    parser.add_argument('--snapshot', metavar='PATH', help='also publish every heatmap in this snapshot file')
+    parser.add_argument('--csv', metavar='PATH', help='also write every heatmap to this csv file')
+    parser.add_argument('--replace', action='store_true', help='take over the shared grid left behind by a generator that did not exit cleanly')
+    args = parser.parse_args()
+
+    scenario = demo_scenario(args.levels, args.units, args.fires, args.seed)
+    try:
+        grid = DemoGrid.create_shared(args.levels, args.units, replace=args.replace)
+    except FileExistsError:
+        parser.exit(1, f'The shared grid {DEMO_SHM_NAME} exists, another generator may be running. Stop it or pass --replace.\n')
+    sequence = 0
+    try:
+        heatmap = scenario.frame()
+        while True:
+            grid.write(heatmap)
+            sequence += 1
+
+            if args.snapshot:
+                write_snapshot(args.snapshot, sequence, heatmap)
+            if args.csv:
+                lines = io.StringIO(newline='')
+                csv.writer(lines).writerows(csv_rows(heatmap))
+                write_atomically(args.csv, [lines.getvalue().encode()])
+            time.sleep(1)
+
+            if scenario.finished():
+                scenario.restart()
+            heatmap = scenario.step(args.speed)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        grid.close(unlink=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objs as go
+
+### This file contains the grid builder drawing the live heatmaps
+
+
+# Heatmap figure of a fixed (levels x units) grid. The figure template is built and
+# validated by plotly once, and each refresh only fills a preallocated NumPy grid by
+# index lookup and drops it into a copy of the template's trace.
+class HeatmapGrid:
+    def __init__(self, levels, units):
+        self.levels = pd.Index(levels)
+        self.units = pd.Index(units)
+        self.shape = (len(self.levels), len(self.units))
+        template = go.Figure(
+            data=go.Heatmap(
+                x=[str(unit) for unit in units],
+                y=[str(level) for level in levels],
+                zmin=20,
+                zmax=60,
+                colorscale='temps',
+                colorbar=dict(orientation='h', title=dict(text='Temperature')),
+                hovertemplate='Unit: %{x} <br>Level: %{y} <br>Temperature: %{z}'
+            ),
+            layout=go.Layout(
+                xaxis=dict(title='Unit', type='category'),
+                yaxis=dict(title='Level', type='category'),
+                margin=dict(l=0, r=0, t=0, b=0)
+            )
+        ).to_plotly_json()
+        self.trace = template['data'][0]
+        self.layout = template['layout']
+
+    # Function to return the (level, unit) grid positions of every reading
+    def locate(self, readings_df):
+        return self.levels.get_indexer(readings_df['level']), self.units.get_indexer(readings_df['unit'])
+
+    # Function to fill the grid with the readings, cells without a reading stay empty
+    def fill(self, readings_df):
+        z = np.full(self.shape, np.nan)
+        rows, columns = self.locate(readings_df)
+        known = (rows >= 0) & (columns >= 0)
+        z[rows[known], columns[known]] = readings_df['temperature'].values[known]
+        return z
+
+    def figure(self, readings_df):
+        return {'data': [dict(self.trace, z=self.fill(readings_df))], 'layout': self.layout}
+
+    # Function to list the grid cells of the given reading rows as [[row, column, temperature], ...],
+    # with None for a sensor that has no reading
+    def cells(self, readings_df, reading_rows):
+        rows, columns = self.locate(readings_df)
+        temperatures = readings_df['temperature'].values.astype(float)
+        return [
+            [int(rows[n]), int(columns[n]), None if np.isnan(temperatures[n]) else float(temperatures[n])]
+            for n in reading_rows if rows[n] >= 0 and columns[n] >= 0
+        ]
+
+
+# Function to return the grid of the given levels and units, built once per layout
+@lru_cache(maxsize=64)
+def heatmap_grid(levels, units):
+    return HeatmapGrid(levels, units)
+
+# Function to return the grid sized to the levels and units present in a set of readings
+def grid_for_readings(readings_df):
+    return heatmap_grid(tuple(sorted(readings_df['level'].unique())), tuple(sorted(readings_df['unit'].unique())))
@@ -1,151 +1,240 @@
-from dash import html, dcc, Output, Input, callback_context, register_page, callback
+from dash import html, dcc, Output, Input, State, callback_context, register_page, callback, clientside_callback
 import plotly.graph_objs as go
 import pandas as pd
 import dash_mantine_components as dmc
 import dash_bootstrap_components as dbc
-import psycopg2
 from dash.exceptions import PreventUpdate
+from pages.alerts import RATE_OF_RISE, RATE_WINDOW
+from pages.cache import ResultCache, ttl_for_range
+from pages.database import pool
+from pages.downsampling import minmax_downsample
+from pages.exports import export_url
+from pages.metrics import instrumented, record_rows, stage
+from pages.registry import available_blocks, get_registry, knows_block
+from pages.rate_of_rise import first_crossing, rate_of_rise
+from pages.rollups import choose_rollup, fetch_rollup, raw_series_statement, rollups_ready
+from pages.tiles import TileCache
+
+# Maximum number of points sent per line, roughly two per horizontal pixel of the graph
+MAX_POINTS_PER_TRACE = 2000
+# Tiles spanning the visible window of the graph, each tile holds its share of the points
+TILES_PER_VIEW = 4
 
 
 ### Function to generate options with 10-minute intervals
 def generate_options_time():
     return [{'label': f'{hour:02d}:{minute:02d}', 'value': f'{hour:02d}:{minute:02d}'} for hour in range(24) for minute in range(0, 60, 10)]
 
-### Function to collect historical temperature data
-def collect_historical_data(start_datetime, end_datetime, selected_lines):
-    # Separating main dataframe into individual dataframe unique to each sensor
-    historical_dfs = [None] * 6
-    n = 0
-    for level in range(1, 4):
-        for unit in range(1407, 1409):
-            historical_query = '''
-                SELECT 
-                    date, temperature, level, unit
-                FROM 
-                    data
-                WHERE 
-                    level = '{}' AND
-                    unit = '{}' AND
-                    date BETWEEN '{}' AND '{}'
-                ORDER BY 
-                    date
-            '''
-            historical_df = pd.read_sql_query(historical_query.format(level, unit, start_datetime, end_datetime), con=connection)
-            historical_dfs[n] = historical_df
-            n += 1
-
-    cleaned_data = {
-        'date': historical_dfs[0]['date'],
-        'Level: 1, Unit: 1407': historical_dfs[0]['temperature'],
-        'Level: 1, Unit: 1408': historical_dfs[1]['temperature'],
-        'Level: 2, Unit: 1407': historical_dfs[2]['temperature'],
-        'Level: 2, Unit: 1408': historical_dfs[3]['temperature'],
-        'Level: 3, Unit: 1407': historical_dfs[4]['temperature'],
-        'Level: 3, Unit: 1408': historical_dfs[5]['temperature']
+### Function to query the temperature series of all given sensors in [start, end) in a single round trip, one column per unit label.
+### When max_points is given, the coarsest rollup still giving that many points is read instead of the raw rows
+### (once the rollup tables exist)
+def fetch_historical_data(start_datetime, end_datetime, sensor_ids, max_points=None):
+    params = {
+        'sensor_ids': list(sensor_ids),
+        'start': start_datetime,
+        'end': end_datetime
     }
-    cleaned_historical_df = pd.DataFrame(cleaned_data)
+    with stage('fetch'), pool.connection() as connection:
+        rollup = choose_rollup(start_datetime, end_datetime, max_points) if max_points and rollups_ready(connection) else None
+        if rollup is not None:
+            historical_df = fetch_rollup(connection, *rollup, start_datetime, end_datetime, sensor_ids)
+        else:
+            historical_df = raw_series_statement.read(connection, params, parse_dates=['date'])
+    record_rows(len(historical_df))
+
+    # Pivoting into one column per unit on a shared timestamp index, so readings
+    # line up by time even when sensors report at different moments
+    with stage('reshape'):
+        historical_df['series'] = historical_df['sensorid'].map(get_registry().labels)
+        return historical_df.pivot_table(index='date', columns='series', values='temperature', aggfunc='mean')
+
+### Function to read the zoomed-in x range out of the graph's relayoutData, None when zoomed out
+def visible_range_from(relayout_data):
+    if not relayout_data or relayout_data.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        return pd.Timestamp(relayout_data['xaxis.range[0]']), pd.Timestamp(relayout_data['xaxis.range[1]'])
+    if 'xaxis.range' in relayout_data:
+        return pd.Timestamp(relayout_data['xaxis.range'][0]), pd.Timestamp(relayout_data['xaxis.range'][1])
+    return None
+
+### Function to load the series of every unit over the range, with the zoomed-in window at a finer resolution
+def load_historical_series(start, end, sensor_ids, visible_range):
+    historical_series = tile_cache.get_window(start, end, sensor_ids)
 
-    # Appending a list of traces based on selected house units into line graph
-    traces = []
-    for line in selected_lines:
-        trace = go.Scatter(
-            x = cleaned_historical_df['date'],
-            y = cleaned_historical_df[line],
+    # The rest of the range stays coarse so the rangeslider still shows the whole incident
+    if visible_range is not None:
+        visible_start, visible_end = visible_range
+        detail_series = tile_cache.get_window(visible_start, visible_end, sensor_ids)
+        for line, series in historical_series.items():
+            historical_series[line] = pd.concat([
+                series[series.index < visible_start],
+                detail_series.get(line, series.iloc[:0]),
+                series[series.index > visible_end]
+            ])
+    return historical_series
+
+### Function to compute the rate of rise of every unit on its raw readings, as downsampling
+### would distort the slopes, keeping the downsampled rate for the graph along with the time
+### and temperature where it first reaches the rise threshold. Returns {line: (rate, window, crossing, temperature)}
+def load_rate_of_rise(start, end, sensor_ids, rise_threshold):
+    raw_df = fetch_historical_data(start, end, sensor_ids)
+    rates = {}
+    with stage('rate_of_rise'):
+        for line in raw_df.columns:
+            series = raw_df[line].dropna()
+            rate, window = rate_of_rise(series, RATE_WINDOW)
+            crossing = first_crossing(rate, rise_threshold)
+            temperature = series.asof(crossing) if crossing is not None else None
+            rate = rate.dropna()
+            x, y = minmax_downsample(rate.index, rate.values, MAX_POINTS_PER_TRACE)
+            rates[line] = (pd.Series(y, index=x), window, crossing, temperature)
+    return rates
+
+### Function to build the rate-of-rise overlay of one unit: its °C/min line on the second
+### y-axis and a marker where it first reaches the rise threshold
+def rate_of_rise_traces(line, rate, window, crossing, temperature, rise_threshold, visible):
+    traces = [
+        go.Scatter(
+            x = rate.index,
+            y = rate.values,
             mode = 'lines',
-            name = line,
-            connectgaps=False
+            name = f'{line} (°C/min)',
+            legendgroup = line,
+            visible = visible,
+            yaxis = 'y2',
+            line = dict(dash='dot', width=1),
+            connectgaps=False,
+            hovertemplate=f'Date: %{{x}} <br> Rate of rise: %{{y:.2f}} °C/min over {window:.0f}s'
         )
-        traces.append(trace)
+    ]
+    if crossing is not None:
+        traces.append(go.Scatter(
+            x = [crossing],
+            y = [temperature],
+            mode = 'markers',
+            name = f'{line} first rise',
+            legendgroup = line,
+            showlegend = False,
+            visible = visible,
+            marker = dict(symbol='x', size=12, color='red'),
+            hovertemplate=f'First rise of {rise_threshold} °C/min or more <br> Date: %{{x}} <br> Temperature: %{{y}}'
+        ))
+    return traces
+
+### Function to collect historical temperature data of a block, with the rate-of-rise
+### overlay when a rise threshold is given
+def collect_historical_data(block, start_datetime, end_datetime, selected_lines, visible_range=None, rise_threshold=None):
+    start, end = pd.Timestamp(start_datetime), pd.Timestamp(end_datetime)
+    if visible_range is not None:
+        visible_start, visible_end = max(start, visible_range[0]), min(end, visible_range[1])
+        visible_range = (visible_start, visible_end) if visible_start < visible_end else None
+
+    # Results are cached on the normalized range and sensor set, so toggling units or
+    # reopening a recent range is served from memory
+    registry = get_registry()
+    sensor_ids = tuple(sorted(registry.sensors(block)))
+    historical_series = result_cache.get_or_compute(
+        (start, end, sensor_ids, visible_range),
+        lambda: load_historical_series(start, end, sensor_ids, visible_range),
+        ttl=ttl_for_range(end)
+    )
+
+    with stage('figure'):
+        # Appending a trace for every house unit into line graph. Units that are not selected
+        # are only hidden, so the unit selector can toggle them in the browser without a round trip
+        traces = []
+        for line, sensorid in registry.unit_options(block):
+            if line not in historical_series:
+                continue
+            series = historical_series[line]
+            trace = go.Scatter(
+                x = series.index,
+                y = series.values,
+                mode = 'lines',
+                name = line,
+                legendgroup = line,
+                visible = line in selected_lines,
+                connectgaps=False
+            )
+            traces.append(trace)
     
-    # Customizing the layout of the line graph
-    layout = go.Layout(title='',
-                  xaxis=dict(title='Datetime'),
-                  yaxis=dict(title='Temperature'))
+        # Customizing the layout of the line graph
+        layout = go.Layout(title='',
+                      xaxis=dict(title='Datetime'),
+                      yaxis=dict(title='Temperature'))
     
-    historical_graph = go.Figure(data=traces, layout=layout)
-    historical_graph.update_layout(
-        legend=dict(
-            yanchor="top",
-            y=0.99,
-            xanchor="right",
-            x=0.99
-        ),
-        margin=dict(l=0, r=0, t=0, b=0)
-    )
-    historical_graph.update_xaxes(
-        rangeslider_visible=True,
-    )
-    historical_graph.update_traces(
-        hovertemplate='Date: %{x} <br> Temperature: %{y}'
-    )
+        historical_graph = go.Figure(data=traces, layout=layout)
+        historical_graph.update_layout(
+            legend=dict(
+                yanchor="top",
+                y=0.99,
+                xanchor="right",
+                x=0.99
+            ),
+            margin=dict(l=0, r=0, t=0, b=0)
+        )
+        historical_graph.update_xaxes(
+            rangeslider_visible=True,
+        )
+        if visible_range is not None:
+            historical_graph.update_xaxes(
+                range=[visible_start, visible_end],
+                rangeslider_range=[start, end]
+            )
+        historical_graph.update_traces(
+            hovertemplate='Date: %{x} <br> Temperature: %{y}'
+        )
+
+    # Rate of rise overlay, computed on the raw readings of the whole range
+    if rise_threshold is not None:
+        rates = result_cache.get_or_compute(
+            ('rate_of_rise', start, end, sensor_ids, rise_threshold),
+            lambda: load_rate_of_rise(start, end, sensor_ids, rise_threshold),
+            ttl=ttl_for_range(end)
+        )
+        for line, sensorid in registry.unit_options(block):
+            if line in rates:
+                historical_graph.add_traces(rate_of_rise_traces(line, *rates[line], rise_threshold, line in selected_lines))
+        historical_graph.update_layout(
+            yaxis2=dict(title='Rate of rise (°C/min)', overlaying='y', side='right', showgrid=False)
+        )
     return historical_graph
 
 
 #-------------------------- Initialization --------------------------#
 register_page(__name__, path="/historical-data")
-connection = psycopg2.connect(
-    user="dbfirenet_user", 
-    password="G9Fw38n8WjMfN4zTBydkxYqZFefZSiM4", 
-    host="dpg-ck0lntu3ktkc73f98tcg-a.singapore-postgres.render.com", 
-    port="5432", 
-    database="dbfirenet"
+tile_cache = TileCache(
+    lambda tile_start, tile_end, sensor_ids: fetch_historical_data(tile_start, tile_end, sensor_ids, MAX_POINTS_PER_TRACE // TILES_PER_VIEW),
+    base_width='10min',
+    points_per_tile=MAX_POINTS_PER_TRACE // TILES_PER_VIEW,
+    tiles_per_view=TILES_PER_VIEW,
+    max_tiles=256
 )
-cursor = connection.cursor()
+result_cache = ResultCache(max_entries=64)
 
 
 ### Historical Data Page Content ###
-# Dropdown menu items for block number selection
-historical_dropdown_menu_items = [
-    dbc.DropdownMenuItem("Block 123", id="historical-dropdown-menu-item-1"),
-    dbc.DropdownMenuItem("Block 124", id="historical-dropdown-menu-item-2"),
-    dbc.DropdownMenuItem("Block 125", id="historical-dropdown-menu-item-3"),
-    dbc.DropdownMenuItem(divider=True),
-    dbc.DropdownMenuItem("Clear", id="historical-dropdown-menu-item-clear"),
-]
-
-# Dropdown menu for block number selection
-historical_data_filter_dropdown =  dbc.InputGroup(
-    [
-        dbc.DropdownMenu(historical_dropdown_menu_items, label="Select"),
-        dbc.Input(id="historical-input-group-dropdown-input", placeholder="Block Number", disabled=True),
-    ],
-    size="sm"
-)
-
-# Callback function for dropdown menu
-@callback(
-    Output("historical-input-group-dropdown-input", "value"),
-    [
-        Input("historical-dropdown-menu-item-1", "n_clicks"),
-        Input("historical-dropdown-menu-item-2", "n_clicks"),
-        Input("historical-dropdown-menu-item-3", "n_clicks"),
-        Input("historical-dropdown-menu-item-clear", "n_clicks"),
-    ],
-)
-def on_button_click(n1, n2, n3, n_clear):
-    if not callback_context.triggered:
-        return ""
-    else:
-        button_id = callback_context.triggered[0]["prop_id"].split(".")[0]
-
-    if button_id == "historical-dropdown-menu-item-clear":
-        return ""
-    elif button_id == "historical-dropdown-menu-item-1":
-        return "Block 123"
-    elif button_id == "historical-dropdown-menu-item-2":
-        return "Block 124"
-    else:
-        return "Block 125"
+# Searchable dropdown of the registered building blocks
+def historical_data_filter_dropdown():
+    return dcc.Dropdown(
+        id="historical-block-select",
+        options=[{'label': f'Block {block}', 'value': block} for block in available_blocks()],
+        placeholder="Block Number",
+        searchable=True,
+        clearable=True,
+    )
 
 # Historical data block number selector layout
-historical_data_filter = dbc.Card(
-    dbc.CardBody(
-        [
-            html.H5("Select building block number", className="card-title"),
-            historical_data_filter_dropdown,
-        ]
+def historical_data_filter():
+    return dbc.Card(
+        dbc.CardBody(
+            [
+                html.H5("Select building block number", className="card-title"),
+                historical_data_filter_dropdown(),
+            ]
+        )
     )
-)
 
 # Historical data datetime selector layout
 historical_data_datetime = dbc.Card(
@@ -177,52 +266,68 @@ historical_data_datetime = dbc.Card(
     )
 )
 
-# Historical data unit selector layout
-historical_data_unit = dbc.Card(
-    dbc.CardBody(
-        [
-            html.H5("Select unit", className="card-title"),
-            dcc.Checklist(
-                id='historical-line-select',
-                options=[
-                    {'label': 'Level: 1, Unit: 1407', 'value': 'Level: 1, Unit: 1407'},
-                    {'label': 'Level: 1, Unit: 1408', 'value': 'Level: 1, Unit: 1408'},
-                    {'label': 'Level: 2, Unit: 1407', 'value': 'Level: 2, Unit: 1407'},
-                    {'label': 'Level: 2, Unit: 1408', 'value': 'Level: 2, Unit: 1408'},
-                    {'label': 'Level: 3, Unit: 1407', 'value': 'Level: 3, Unit: 1407'},
-                    {'label': 'Level: 3, Unit: 1408', 'value': 'Level: 3, Unit: 1408'}
-                ],
-                value=['Level: 1, Unit: 1407', 'Level: 1, Unit: 1408', 'Level: 2, Unit: 1407', 'Level: 2, Unit: 1408', 'Level: 3, Unit: 1407', 'Level: 3, Unit: 1408']
-            )
-        ]
+# Historical data unit selector layout of a block
+def historical_data_unit(block):
+    unit_options = get_registry().unit_options(block)
+    return dbc.Card(
+        dbc.CardBody(
+            [
+                html.H5("Select unit", className="card-title"),
+                dcc.Checklist(
+                    id='historical-line-select',
+                    options=[{'label': label, 'value': label} for label, sensorid in unit_options],
+                    value=[label for label, sensorid in unit_options]
+                ),
+                html.H6("Rate of rise", style={"margin-top": "10px"}),
+                dbc.Switch(id='rate-of-rise-toggle', label="Show °C/min", value=False),
+                dbc.InputGroup(
+                    [
+                        dbc.InputGroupText("Flag at"),
+                        dbc.Input(id='rate-of-rise-threshold', type='number', min=0, step=0.1, value=RATE_OF_RISE),
+                        dbc.InputGroupText("°C/min"),
+                    ],
+                    size="sm"
+                )
+            ]
+        )
     )
-)
 
-# Historical data graph layout
-historical_data_graph = dbc.Card(
-    dbc.CardBody(
-        [
-            html.H5("Historical Temperature Data", className="card-title"),
-            html.P(
-                "For Block 123"
-            ),
-            dcc.Graph(
-                id='historical-graph',
-                config={'displayModeBar': False}
-            )
-        ]
+# Historical data graph layout of a block
+def historical_data_graph(block):
+    return dbc.Card(
+        dbc.CardBody(
+            [
+                html.H5("Historical Temperature Data", className="card-title"),
+                html.P(
+                    f"For Block {block}"
+                ),
+                dcc.Graph(
+                    id='historical-graph',
+                    config={'displayModeBar': False}
+                ),
+                # Raw readings of the selected units and range, streamed by pages/exports.py
+                html.Div(
+                    [
+                        dbc.Button("Download CSV", id='export-csv-link', color='secondary', size='sm', external_link=True, disabled=True, className="me-2"),
+                        dbc.Button("Download Parquet", id='export-parquet-link', color='secondary', size='sm', external_link=True, disabled=True),
+                    ],
+                    style={"margin-top": "10px"}
+                )
+            ]
+        )
     )
-)
 
 #--------------------------- Historical data page layout -----------------------------#
-layout = dbc.Row(
-    [
-        dbc.Col(historical_data_filter, width="3px"),
-        dbc.Col(historical_data_datetime, id="historical-datetime-selector", width="3px"),
-        dbc.Col(historical_data_unit, id="historical-unit-selector", width="3px"),
-        dbc.Col(historical_data_graph, id="historical-card", width="10px"),
-    ]
-)
+# Built on every page load so newly registered blocks show up in the dropdown
+def layout():
+    return dbc.Row(
+        [
+            dbc.Col(historical_data_filter(), width="3px"),
+            dbc.Col(id="historical-datetime-selector", width="3px"),
+            dbc.Col(id="historical-unit-selector", width="3px"),
+            dbc.Col(id="historical-card", width="10px"),
+        ]
+    )
 
 #----------------------------- Callback Functions --------------------------------#
 # Callback function to expand historical datetime selector after block number is selected
@@ -232,27 +337,95 @@ layout = dbc.Row(
         Output("historical-unit-selector", "children"),
         Output("historical-card", "children")
     ],
-    Input("historical-input-group-dropdown-input", "value"),
+    Input("historical-block-select", "value"),
 )
-def show_historical_selectors(block_number):
-    if block_number == "Block 123":
-        return historical_data_datetime, historical_data_unit, historical_data_graph
+@instrumented('historical.show_historical_selectors')
+def show_historical_selectors(block):
+    if block is not None and knows_block(block):
+        return historical_data_datetime, historical_data_unit(block), historical_data_graph(block)
     else:
         return "", "", ""
 
-# Callback function for generating historical data graph based on selected datetime and unit
+# Callback function for generating historical data graph based on selected datetime
 @callback(
     Output('historical-graph', 'figure'),
     Input('date-range-picker', 'value'),
     Input('date-range-picker', 'value'),
     Input('start-time-selector', 'value'),
     Input('end-time-selector', 'value'),
-    Input('historical-line-select', 'value'),
+    Input('historical-graph', 'relayoutData'),
+    Input('rate-of-rise-toggle', 'value'),
+    Input('rate-of-rise-threshold', 'value'),
+    State('historical-line-select', 'value'),
+    State('historical-block-select', 'value'),
 )
-def update_graph(start_date, end_date, start_time, end_time, selected_lines):
+@instrumented('historical.update_graph')
+def update_graph(start_date, end_date, start_time, end_time, relayout_data, show_rate_of_rise, rise_threshold, selected_lines, block):
+    if block is None or not knows_block(block):
+        raise PreventUpdate
     if start_date is None or end_date is None or start_time is None or end_time is None:
         raise PreventUpdate
     start_datetime = f'{start_date[0]} {str(start_time)}'
     end_datetime = f'{end_date[1]} {str(end_time)}'
-    historical_graph = collect_historical_data(start_datetime, end_datetime, selected_lines)
+
+    # Zooming and panning re-query the visible window at a finer resolution,
+    # a new date range starts zoomed out again
+    if callback_context.triggered_id == 'historical-graph':
+        if not relayout_data or not ('xaxis.autorange' in relayout_data or any(key.startswith('xaxis.range') for key in relayout_data)):
+            raise PreventUpdate
+        visible_range = visible_range_from(relayout_data)
+    elif callback_context.triggered_id in ('rate-of-rise-toggle', 'rate-of-rise-threshold'):
+        # Switching the overlay keeps the current zoom
+        visible_range = visible_range_from(relayout_data)
+    else:
+        visible_range = None
+    rise_threshold = rise_threshold if show_rate_of_rise and rise_threshold is not None else None
+    historical_graph = collect_historical_data(block, start_datetime, end_datetime, selected_lines or [], visible_range, rise_threshold)
     return historical_graph
+
+# Callback function to point the download buttons at the selected block, units and date range
+@callback(
+    Output('export-csv-link', 'href'),
+    Output('export-parquet-link', 'href'),
+    Output('export-csv-link', 'disabled'),
+    Output('export-parquet-link', 'disabled'),
+    Input('date-range-picker', 'value'),
+    Input('start-time-selector', 'value'),
+    Input('end-time-selector', 'value'),
+    Input('historical-line-select', 'value'),
+    State('historical-block-select', 'value'),
+)
+@instrumented('historical.update_export_links')
+def update_export_links(date_range, start_time, end_time, selected_lines, block):
+    if date_range is None or start_time is None or end_time is None or not selected_lines:
+        return None, None, True, True
+    if block is None or not knows_block(block):
+        return None, None, True, True
+    start_datetime = f'{date_range[0]} {str(start_time)}'
+    end_datetime = f'{date_range[1]} {str(end_time)}'
+    sensor_ids = [sensorid for line, sensorid in get_registry().unit_options(block) if line in selected_lines]
+    return (
+        export_url(block, 'csv', start_datetime, end_datetime, sensor_ids),
+        export_url(block, 'parquet', start_datetime, end_datetime, sensor_ids),
+        False,
+        False
+    )
+
+# Clientside callback showing only the selected units. The figure already holds every
+# unit's series (and rate-of-rise overlay, grouped under the unit's legend group), so
+# toggling a unit costs no server work and no network traffic
+clientside_callback(
+    '''
+    function(selected_lines, figure) {
+        if (!figure || !figure.data) {
+            return window.dash_clientside.no_update;
+        }
+        const data = figure.data.map(trace => ({...trace, visible: selected_lines.includes(trace.legendgroup || trace.name)}));
+        return {...figure, data: data};
+    }
+    ''',
+    Output('historical-graph', 'figure', allow_duplicate=True),
+    Input('historical-line-select', 'value'),
+    State('historical-graph', 'figure'),
+    prevent_initial_call=True
+)
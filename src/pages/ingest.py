@@ -0,0 +1,271 @@
+import csv
+import hmac
+import io
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import pandas as pd
+import psycopg2
+from flask import Blueprint, abort, jsonify, request
+
+from pages.database import DATA_TIMEZONE, PoolTimeout, data_now, pool
+
+### This file contains the HTTP ingest of sensor readings. Readings are buffered in memory
+### and written to the data table in batches with COPY, so the database sees one statement
+### (and one run of the data triggers) per batch instead of one INSERT per reading.
+###     POST /ingest   {"sensorid": "42261f3", "temperature": 31.5, "date": "2023-09-01T12:00:00", "level": "1", "unit": "1407"}
+###                    or a list of such readings, or {"readings": [...]}
+###     GET  /ingest/stats
+
+
+# Readings held in memory per worker before new requests are turned away
+INGEST_BUFFER_CAPACITY = int(os.environ.get('INGEST_BUFFER_CAPACITY', 100000))
+# A batch is written as soon as this many readings are waiting, or after INGEST_FLUSH_INTERVAL seconds
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 5000))
+INGEST_FLUSH_INTERVAL = float(os.environ.get('INGEST_FLUSH_INTERVAL', 0.2))
+# Seconds the writer waits before retrying a failed batch, doubled after every failed attempt
+# up to INGEST_MAX_RETRY_DELAY
+INGEST_RETRY_DELAY = 1
+INGEST_MAX_RETRY_DELAY = 30
+# Attempts at writing a batch failing for reasons other than the database being unreachable,
+# before it is treated as holding readings the database rejects
+INGEST_MAX_ATTEMPTS = int(os.environ.get('INGEST_MAX_ATTEMPTS', 5))
+# Requests must carry the header "Authorization: Bearer <INGEST_TOKEN>". Without a token
+# configured the endpoint refuses every request rather than accepting anonymous readings
+INGEST_TOKEN = os.environ.get('INGEST_TOKEN')
+# Seconds of history the throughput rate is measured over, and between throughput log lines
+THROUGHPUT_WINDOW = 10
+REPORT_INTERVAL = 60
+
+copy_readings = 'COPY data (sensorid, temperature, date, level, unit) FROM STDIN WITH (FORMAT csv)'
+
+
+# Raised for a reading that cannot be stored
+class InvalidReading(ValueError):
+    pass
+
+
+# Errors of a database that cannot be reached, after which a batch is retried for as long as it takes
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeout)
+
+
+# Function to turn a reading's date into the naive local form of the date column,
+# stamping readings without a date with the time they arrived
+def reading_date(value, received_at):
+    if value is None:
+        return received_at
+    try:
+        date = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise InvalidReading(f'date {value!r} is not an ISO date')
+    if date.tzinfo is not None:
+        date = pd.Timestamp(date).tz_convert(DATA_TIMEZONE).tz_localize(None).to_pydatetime()
+    return date
+
+# Function to validate one reading, returning it as a (sensorid, temperature, date, level, unit) row
+def reading_row(reading, received_at):
+    if not isinstance(reading, dict):
+        raise InvalidReading('every reading must be an object')
+    sensorid = reading.get('sensorid')
+    if not isinstance(sensorid, str) or not sensorid:
+        raise InvalidReading('sensorid must be a non-empty string')
+    temperature = reading.get('temperature')
+    if isinstance(temperature, bool) or not isinstance(temperature, (int, float)) or not math.isfinite(temperature):
+        raise InvalidReading(f'temperature of {sensorid} must be a number')
+    level, unit = reading.get('level'), reading.get('unit')
+    if isinstance(level, (dict, list)) or isinstance(unit, (dict, list)):
+        raise InvalidReading(f'level and unit of {sensorid} must be strings or numbers')
+    return (
+        sensorid,
+        float(temperature),
+        reading_date(reading.get('date'), received_at),
+        None if level is None else str(level),
+        None if unit is None else str(unit),
+    )
+
+
+# Function to write a batch of reading rows to the data table in one COPY
+def write_readings(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    with pool.connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(copy_readings, buffer)
+        connection.commit()
+
+
+# Counters of the ingest, with the write rate over the last THROUGHPUT_WINDOW seconds
+class ThroughputStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.failed_batches = 0
+        self.dropped = 0
+        self.last_batch = None
+        # (monotonic time, readings written) of recent batches
+        self.batches = deque()
+
+    def record_batch(self, size, seconds):
+        now = time.monotonic()
+        with self.lock:
+            self.written += size
+            self.last_batch = {'readings': size, 'ms': round(seconds * 1000, 3)}
+            self.batches.append((now, size))
+            while self.batches and self.batches[0][0] < now - THROUGHPUT_WINDOW:
+                self.batches.popleft()
+
+    def report(self, buffered):
+        now = time.monotonic()
+        with self.lock:
+            recent = sum(size for written_at, size in self.batches if written_at >= now - THROUGHPUT_WINDOW)
+            return {
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'written': self.written,
+                'failed_batches': self.failed_batches,
+                'dropped': self.dropped,
+                'buffered': buffered,
+                'readings_per_second': round(recent / THROUGHPUT_WINDOW, 1),
+                'last_batch': self.last_batch,
+            }
+
+
+# In-memory buffer between the ingest requests and the database. Requests only append
+# to it, a single writer thread per worker drains it in batches. When the database falls
+# behind the buffer fills up and offer() refuses readings, which the endpoint turns into
+# a 503 so senders back off instead of the worker running out of memory. A batch the
+# database refuses is retried, ahead of newer readings, backing off between attempts. While
+# the database cannot be reached the batch is retried for as long as that lasts and the
+# buffer fills up, turning senders away. When the database rejects the readings themselves
+# (bad data, a constraint), or a batch keeps failing otherwise for max_attempts attempts,
+# the batch is split in halves so the good readings still get written and only the rejected
+# ones end up dropped and logged, instead of one bad reading blocking the ingest.
+class IngestBuffer:
+    def __init__(self, write, capacity, batch_size, flush_interval, max_attempts=INGEST_MAX_ATTEMPTS):
+        self.write = write
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.rows = deque()
+        # (batch, failed attempts) of batches waiting for another attempt, oldest first
+        self.retries = deque()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stats = ThroughputStats()
+
+    # Function to queue a list of rows, all or nothing. Returns False when they do not fit
+    def offer(self, rows):
+        with self.condition:
+            if self.buffered() + len(rows) > self.capacity:
+                self.stats.rejected += len(rows)
+                return False
+            self.rows.extend(rows)
+            self.stats.accepted += len(rows)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            if len(self.rows) >= self.batch_size:
+                self.condition.notify()
+        return True
+
+    # Function to return the next (batch, failed attempts), retries first
+    def take(self):
+        with self.condition:
+            if self.retries:
+                return self.retries.popleft()
+            self.condition.wait_for(lambda: len(self.rows) >= self.batch_size, timeout=self.flush_interval)
+            return [self.rows.popleft() for _ in range(min(len(self.rows), self.batch_size))], 0
+
+    # Function to queue a failed batch for another attempt, returning the seconds to wait before it
+    def failed(self, batch, attempts, error):
+        logger = logging.getLogger(__name__)
+        if isinstance(error, CONNECTION_ERRORS):
+            rejected = False
+        else:
+            rejected = isinstance(error, (psycopg2.DataError, psycopg2.IntegrityError)) or attempts >= self.max_attempts
+        with self.condition:
+            self.stats.failed_batches += 1
+            if not rejected:
+                logger.warning('Writing %d readings failed (attempt %d), retrying: %s', len(batch), attempts, error)
+                self.retries.appendleft((batch, attempts))
+            elif len(batch) > 1:
+                middle = len(batch) // 2
+                self.retries.extendleft([(batch[middle:], 0), (batch[:middle], 0)])
+            else:
+                self.stats.dropped += 1
+                logger.error('Dropping reading %r, the database rejected it: %s', batch[0], error)
+        if rejected:
+            return 0
+        return min(INGEST_RETRY_DELAY * 2 ** (attempts - 1), INGEST_MAX_RETRY_DELAY)
+
+    # Function to count the readings held, waiting or being retried
+    def buffered(self):
+        return len(self.rows) + sum(len(batch) for batch, _ in self.retries)
+
+    def run(self):
+        logger = logging.getLogger(__name__)
+        reported_at = time.monotonic()
+        while True:
+            batch, attempts = self.take()
+            if batch:
+                started = time.perf_counter()
+                try:
+                    self.write(batch)
+                    self.stats.record_batch(len(batch), time.perf_counter() - started)
+                except Exception as error:
+                    time.sleep(self.failed(batch, attempts + 1, error))
+            if time.monotonic() - reported_at >= REPORT_INTERVAL:
+                logger.info('Ingest %s', self.report())
+                reported_at = time.monotonic()
+
+    def report(self):
+        with self.condition:
+            buffered = self.buffered()
+        return self.stats.report(buffered)
+
+
+ingest_routes = Blueprint('ingest', __name__)
+ingest_buffer = IngestBuffer(write_readings, INGEST_BUFFER_CAPACITY, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL)
+
+
+def check_token():
+    if not INGEST_TOKEN:
+        abort(503, 'ingest is disabled, INGEST_TOKEN is not configured')
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {INGEST_TOKEN}'):
+        abort(401)
+
+# Accepts one reading or a batch of readings. Answers 202 once they are buffered (they are
+# written within INGEST_FLUSH_INTERVAL), 400 when any reading is invalid (none are kept),
+# 413 when the batch is larger than the whole buffer and 503 when the buffer is full
+@ingest_routes.route('/ingest', methods=['POST'])
+def ingest_readings():
+    check_token()
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict) and 'readings' in payload:
+        payload = payload['readings']
+    readings = payload if isinstance(payload, list) else [payload]
+    if len(readings) > ingest_buffer.capacity:
+        return jsonify({'error': f'at most {ingest_buffer.capacity} readings per request'}), 413
+
+    received_at = data_now().to_pydatetime()
+    try:
+        rows = [reading_row(reading, received_at) for reading in readings]
+    except InvalidReading as error:
+        return jsonify({'error': str(error)}), 400
+    if not ingest_buffer.offer(rows):
+        return jsonify({'error': 'ingest buffer is full, retry later'}), 503, {'Retry-After': '1'}
+    return jsonify({'accepted': len(rows)}), 202
+
+@ingest_routes.route('/ingest/stats')
+def ingest_stats():
+    check_token()
+    return jsonify(ingest_buffer.report())
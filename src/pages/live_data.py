@@ -0,0 +1,388 @@
+import logging
+import queue
+import select
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import psycopg2
+from dash import Patch
+from dash.exceptions import PreventUpdate
+
+from pages.database import TableCheck
+from pages.heatmap_grid import grid_for_readings
+from pages.metrics import record_rows, stage
+from pages.prepared import PreparedStatement
+
+### This file contains the shared data sources used by the live heatmap pages
+
+
+# The sensor_latest table keeps one row per sensor holding its most recent reading.
+# A statement-level trigger on data upserts the newest row of every inserted batch,
+# so reading the live state costs O(#sensors) no matter how long the history grows.
+# The data table is locked while the table is seeded so no reading can slip in
+# between the initial copy and the trigger going live.
+sensor_latest_setup = '''
+    LOCK TABLE data IN SHARE ROW EXCLUSIVE MODE;
+
+    CREATE OR REPLACE FUNCTION sensor_latest_upsert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO sensor_latest (sensorid, temperature, date, level, unit)
+            SELECT DISTINCT ON (sensorid)
+                sensorid, temperature, date, level, unit
+            FROM
+                new_rows
+            ORDER BY
+                sensorid, date DESC
+        ON CONFLICT (sensorid) DO UPDATE SET
+            temperature = EXCLUDED.temperature,
+            date = EXCLUDED.date,
+            level = EXCLUDED.level,
+            unit = EXCLUDED.unit
+        WHERE
+            sensor_latest.date <= EXCLUDED.date;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TABLE sensor_latest AS
+        SELECT DISTINCT ON (sensorid)
+            sensorid, temperature, date, level, unit
+        FROM
+            data
+        ORDER BY
+            sensorid, date DESC;
+    ALTER TABLE sensor_latest ADD PRIMARY KEY (sensorid);
+
+    CREATE TRIGGER data_sensor_latest
+        AFTER INSERT ON data
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION sensor_latest_upsert();
+'''
+
+# Statement-level trigger waking the live heatmap watchers once per inserted batch.
+# Notifications are delivered on commit and identical ones are merged per transaction.
+reading_notify_setup = '''
+    CREATE OR REPLACE FUNCTION data_notify_readings() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('sensor_readings', '');
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    CREATE TRIGGER data_notify_readings
+        AFTER INSERT ON data
+        FOR EACH STATEMENT EXECUTE FUNCTION data_notify_readings();
+'''
+
+latest_readings_query = '''
+    SELECT
+        sensorid, temperature, date, level, unit
+    FROM
+        sensor_latest
+    WHERE
+        sensorid = ANY(%(sensor_ids)s);
+'''
+latest_readings_statement = PreparedStatement('latest_readings', latest_readings_query)
+
+# Latest readings straight from data, read until the setup step has created sensor_latest
+latest_raw_readings_query = '''
+    SELECT DISTINCT ON (sensorid)
+        sensorid, temperature, date, level, unit
+    FROM
+        data
+    WHERE
+        sensorid = ANY(%(sensor_ids)s)
+    ORDER BY
+        sensorid, date DESC;
+'''
+latest_raw_readings_statement = PreparedStatement('latest_raw_readings', latest_raw_readings_query)
+sensor_latest_ready = TableCheck('sensor_latest')
+
+
+# Function to create the sensor_latest table and the ingest triggers if they do not exist yet.
+# The check runs under a transaction-level advisory lock, so setups running at the same time
+# take turns and only the first one creates anything. Seeding reads the whole data table and
+# blocks ingest meanwhile, so it runs from the setup step (pages/setup.py), never from a page.
+def ensure_sensor_latest(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('firenet.sensor_latest_setup'))")
+        cursor.execute("SELECT to_regclass('sensor_latest')")
+        if cursor.fetchone()[0] is None:
+            cursor.execute(sensor_latest_setup)
+        cursor.execute("SELECT 1 FROM pg_trigger WHERE tgrelid = 'data'::regclass AND tgname = 'data_notify_readings'")
+        if cursor.fetchone() is None:
+            cursor.execute(reading_notify_setup)
+    connection.commit()
+
+# Function to read the latest reading of the given sensors from sensor_latest, or from data
+# while sensor_latest does not exist
+def fetch_latest_readings(connection, sensor_ids):
+    statement = latest_readings_statement if sensor_latest_ready(connection) else latest_raw_readings_statement
+    return statement.read(connection, {'sensor_ids': list(sensor_ids)})
+
+
+# Snapshots kept per page so a client's previous version can still be diffed against
+SNAPSHOT_HISTORY = 32
+
+
+# Function to derive a snapshot version from its content, so every worker process
+# gives the same readings the same version
+def snapshot_version(data):
+    return format(int(pd.util.hash_pandas_object(data[['level', 'unit', 'temperature']], index=False).sum()), 'x')
+
+
+# Snapshot of the latest sensor readings shared by every callback in this process.
+# The first caller after the snapshot goes stale runs the query, every other caller
+# reads the cached copy, so the database sees one query per tick however many
+# browser tabs are polling. Recent versions are kept so clients can be sent only
+# the cells that changed since the version they already show.
+class LatestReadingSnapshot:
+    def __init__(self, fetch, max_age):
+        self.fetch = fetch
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        # (data, version) of the current snapshot, swapped as one so readers never mix them up
+        self.entry = (None, None)
+        self.updated_at = 0.0
+        self.history = OrderedDict()
+
+    @property
+    def data(self):
+        return self.entry[0]
+
+    @property
+    def version(self):
+        return self.entry[1]
+
+    def is_stale(self):
+        return self.data is None or time.monotonic() - self.updated_at >= self.max_age
+
+    # Function to return the current (data, version), refreshing it first when stale
+    def current(self):
+        if not self.is_stale():
+            return self.entry
+
+        # While one thread refreshes, the others keep serving the previous snapshot
+        # instead of queueing up behind the query (only the very first read waits)
+        if not self.lock.acquire(blocking=self.data is None):
+            return self.entry
+        try:
+            if self.is_stale():
+                self.update()
+        finally:
+            self.lock.release()
+        return self.entry
+
+    def get(self):
+        return self.current()[0]
+
+    # Function to re-read the snapshot right away, used when a change is known to have happened
+    def refresh(self):
+        with self.lock:
+            self.update()
+        return self.data
+
+    def update(self):
+        with stage('fetch'):
+            data = self.fetch()
+        record_rows(len(data))
+        # A source handing back the snapshot it returned last time has nothing new
+        if data is self.data:
+            self.updated_at = time.monotonic()
+            return
+        with stage('version'):
+            version = snapshot_version(data)
+        self.entry = (data, version)
+        self.updated_at = time.monotonic()
+        self.history[version] = data
+        self.history.move_to_end(version)
+        while len(self.history) > SNAPSHOT_HISTORY:
+            self.history.popitem(last=False)
+
+    # Function to return the snapshot a client showing `version` has, None if it is no longer known
+    def previous(self, version):
+        return self.history.get(version)
+
+
+# Function to list the heatmap cells whose temperature changed between two snapshots
+# holding the same sensors in the same order, as {'cells': [[row, column, temperature], ...]}
+# in grid coordinates. Returns None when nothing changed or the sensor layout itself changed.
+def temperature_changes(previous, current):
+    if previous is None or len(previous) != len(current):
+        return None
+    if not (previous[['level', 'unit']].values == current[['level', 'unit']].values).all():
+        return None
+    before, after = previous['temperature'].values.astype(float), current['temperature'].values.astype(float)
+    changed = ((before != after) & ~(np.isnan(before) & np.isnan(after))).nonzero()[0]
+    if len(changed) == 0:
+        return None
+    return {'cells': grid_for_readings(current).cells(current, changed)}
+
+# Function to list every heatmap cell of a snapshot as {'cells': [[row, column, temperature], ...]},
+# None for an empty snapshot
+def temperature_cells(current):
+    if current is None or len(current) == 0:
+        return None
+    return {'cells': grid_for_readings(current).cells(current, range(len(current)))}
+
+
+# Clientside callback function returning {'version', 'tick'} for a refresh of a streamed heatmap.
+# The version is the one last pushed over the stream (recorded on the stream container by
+# assets/live_stream.js) when that is newer than the last refresh, otherwise the refresh's own,
+# so the server diffs against what the client really shows. The tick makes every refresh count.
+client_version_function = '''
+    function(n_intervals, version, version_modified, stream) {
+        const container = document.querySelector(`[data-stream="${stream}"]`);
+        if (container && Number(container.dataset.versionAt || 0) > (version_modified || 0)) {
+            version = container.dataset.version || null;
+        }
+        return {version: version, tick: n_intervals};
+    }
+'''
+
+
+# Function to bring a client's heatmap up to date from the version it already shows:
+# no response when nothing changed, a Patch of just the changed cells when its version
+# is still in the history, and a full figure otherwise. Returns (figure, version).
+def heatmap_update(snapshot, client_version, build_figure):
+    data, version = snapshot.current()
+    if version == client_version:
+        raise PreventUpdate
+    with stage('diff'):
+        changes = temperature_changes(snapshot.previous(client_version), data)
+    if changes is None:
+        with stage('figure'):
+            return build_figure(data), version
+    with stage('patch'):
+        patch = Patch()
+        for row, column, temperature in changes['cells']:
+            patch['data'][0]['z'][row][column] = temperature
+    return patch, version
+
+
+# Blocking wait for a Postgres NOTIFY on a channel, returning early on a notification
+# and otherwise after the timeout. The listening connection is re-opened after errors.
+class NotificationListener:
+    def __init__(self, connection_settings, channel, timeout):
+        self.connection_settings = connection_settings
+        self.channel = channel
+        self.timeout = timeout
+        self.connection = None
+
+    def __call__(self):
+        try:
+            if self.connection is None or self.connection.closed:
+                self.connection = psycopg2.connect(**self.connection_settings)
+                self.connection.autocommit = True
+                with self.connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.channel}')
+            if select.select([self.connection], [], [], self.timeout) != ([], [], []):
+                self.connection.poll()
+                self.connection.notifies.clear()
+        except (psycopg2.Error, OSError):
+            if self.connection is not None:
+                self.connection.close()
+            self.connection = None
+            raise
+
+
+# Seconds the watcher backs off after a failed wait or refresh
+WATCHER_RETRY_DELAY = 5
+# Messages kept per subscriber before a slow client starts missing updates
+SUBSCRIBER_BACKLOG = 100
+
+# Single background watcher per process that wakes whenever wait() returns, calls
+# refresh() once, then re-reads the snapshot of every subscribed topic and pushes what
+# changed to that topic's streams (topics without a snapshot are skipped). The thread
+# starts with the first subscriber and stops once the last one leaves, so idle workers
+# do no work. full() turns a snapshot into the message a new stream starts with.
+class SnapshotWatcher:
+    def __init__(self, wait, snapshot_for, diff, full, refresh=None):
+        self.wait = wait
+        self.snapshot_for = snapshot_for
+        self.diff = diff
+        self.full = full
+        self.refresh = refresh
+        # Subscriber queues by topic
+        self.subscribers = {}
+        # Data last published per topic, only touched by the watcher thread
+        self.published = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def subscribe(self, topic=None):
+        subscription = queue.Queue(maxsize=SUBSCRIBER_BACKLOG)
+        with self.lock:
+            self.subscribers.setdefault(topic, set()).add(subscription)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription, topic=None):
+        with self.lock:
+            subscribers = self.subscribers.get(topic, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self.subscribers.pop(topic, None)
+
+    # Function to return the current state of a topic as one message, None without a snapshot.
+    # Changes are diffed against what the watcher last published, not against what a client
+    # has, so every new stream starts from this before any change is applied
+    def baseline(self, topic):
+        snapshot = self.snapshot_for(topic)
+        if snapshot is None:
+            return None
+        data, version = snapshot.current()
+        message = self.full(data)
+        if message is not None:
+            message['version'] = version
+        return message
+
+    def publish(self, topic, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(topic, ()))
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(message)
+            except queue.Full:
+                pass
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    self.thread = None
+                    return
+                topics = list(self.subscribers)
+            try:
+                self.wait()
+                if self.refresh is not None:
+                    self.refresh()
+                for topic in topics:
+                    snapshot = self.snapshot_for(topic)
+                    if snapshot is None:
+                        continue
+                    # Diffing against what this watcher last published rather than the
+                    # snapshot's previous data, which a callback may have refreshed already
+                    # (a new topic starts from the data its pages were built from)
+                    previous = self.published.get(topic, snapshot.data)
+                    snapshot.refresh()
+                    data, version = snapshot.entry
+                    message = self.diff(previous, data)
+                    self.published[topic] = data
+                    if message is not None:
+                        message['version'] = version
+                        self.publish(topic, message)
+                for topic in set(self.published) - set(topics):
+                    del self.published[topic]
+            except Exception:
+                logging.getLogger(__name__).exception('Live data watcher failed, retrying')
+                time.sleep(WATCHER_RETRY_DELAY)
+
+
+# Watchers of the live pages by stream name, served by pages/streams.py
+watchers = {}
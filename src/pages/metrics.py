@@ -0,0 +1,201 @@
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Blueprint, Response, g
+
+### This file contains the instrumentation of the Dash callbacks: per-stage timings, row counts,
+### query counts and payload sizes, served in the Prometheus text format at /metrics.
+### Every worker process keeps its own figures, labelled with its pid.
+
+
+# When set, callback responses carry a Server-Timing header with their stage timings
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+PAYLOAD_BUCKETS = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+
+
+# Timings of one callback call. Stages are exclusive: entering a nested stage pauses the
+# enclosing one, so the stage times add up to the callback's time and show where it went.
+class CallbackTrace:
+    def __init__(self, name):
+        self.name = name
+        self.stages = {}
+        self.rows = 0
+        self.queries = 0
+        # (stage, resumed at) of the stages being timed, innermost last
+        self.stack = []
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def enter(self, stage):
+        now = time.perf_counter()
+        if self.stack:
+            parent, resumed_at = self.stack[-1]
+            self.add(parent, now - resumed_at)
+        self.stack.append((stage, now))
+
+    def exit(self):
+        now = time.perf_counter()
+        stage, resumed_at = self.stack.pop()
+        self.add(stage, now - resumed_at)
+        if self.stack:
+            self.stack[-1] = (self.stack[-1][0], now)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+        self.add('other', max(0.0, self.duration - sum(self.stages.values())))
+
+
+trace_state = threading.local()
+
+def current_trace():
+    return getattr(trace_state, 'trace', None)
+
+# Context manager timing a stage of the running callback, a no-op outside callbacks
+@contextmanager
+def stage(name):
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    trace.enter(name)
+    try:
+        yield
+    finally:
+        trace.exit()
+
+def record_rows(count):
+    trace = current_trace()
+    if trace is not None:
+        trace.rows += count
+
+# Context manager counting and timing one database statement, used by the pool's cursors
+@contextmanager
+def observe_query():
+    trace = current_trace()
+    if trace is not None:
+        trace.queries += 1
+    with stage('sql'):
+        yield
+
+# Decorator instrumenting a Dash callback. The trace is finished when the callback returns
+# (or raises, including PreventUpdate) and recorded once Dash has serialized the response.
+def instrumented(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            trace = CallbackTrace(name)
+            trace_state.trace = trace
+            try:
+                return function(*args, **kwargs)
+            finally:
+                trace.finish()
+                trace_state.trace = None
+                g.callback_trace = trace
+        return wrapper
+    return decorator
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for n, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[n] += 1
+        self.count += 1
+        self.sum += value
+
+
+# Figures of every instrumented callback of this process
+class CallbackMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.payloads = {}
+        self.stages = {}
+        self.rows = {}
+        self.queries = {}
+
+    def record(self, trace, payload_bytes):
+        name = trace.name
+        with self.lock:
+            self.durations.setdefault(name, Histogram(DURATION_BUCKETS)).observe(trace.duration + trace.stages.get('serialize', 0.0))
+            self.payloads.setdefault(name, Histogram(PAYLOAD_BUCKETS)).observe(payload_bytes)
+            for stage_name, seconds in trace.stages.items():
+                self.stages[(name, stage_name)] = self.stages.get((name, stage_name), 0.0) + seconds
+            self.rows[name] = self.rows.get(name, 0) + trace.rows
+            self.queries[name] = self.queries.get(name, 0) + trace.queries
+
+    # Function to render the figures in the Prometheus text exposition format
+    def render(self):
+        pid = os.getpid()
+        lines = []
+
+        def histogram(metric, help_text, histograms):
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} histogram')
+            for name, values in sorted(histograms.items()):
+                labels = f'callback="{name}",pid="{pid}"'
+                for bound, count in zip(values.buckets, values.counts):
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {values.count}')
+                lines.append(f'{metric}_sum{{{labels}}} {values.sum}')
+                lines.append(f'{metric}_count{{{labels}}} {values.count}')
+
+        def counter(metric, help_text, values, label_names):
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} counter')
+            for key, value in sorted(values.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                labels = ','.join(f'{label}="{value_}"' for label, value_ in zip(label_names, key))
+                lines.append(f'{metric}{{{labels},pid="{pid}"}} {value}')
+
+        with self.lock:
+            histogram('firenet_callback_duration_seconds', 'Time to run a callback and serialize its response.', self.durations)
+            histogram('firenet_callback_payload_bytes', 'Size of the serialized callback response.', self.payloads)
+            counter('firenet_callback_stage_seconds_total', 'Time spent per callback stage (sql, fetch, reshape, figure, serialize, ...).', self.stages, ['callback', 'stage'])
+            counter('firenet_callback_rows_total', 'Rows loaded by a callback, from queries and live snapshots.', self.rows, ['callback'])
+            counter('firenet_callback_queries_total', 'Database statements run by a callback.', self.queries, ['callback'])
+        return '\n'.join(lines) + '\n'
+
+
+callback_metrics = CallbackMetrics()
+metrics_routes = Blueprint('metrics', __name__)
+
+
+@metrics_routes.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+# Once Dash has serialized a callback's response, the time since the callback returned is
+# recorded as its serialize stage, along with the size of the payload
+@metrics_routes.after_app_request
+def record_callback(response):
+    trace = g.pop('callback_trace', None)
+    if trace is None:
+        return response
+    request_duration = time.perf_counter() - g.request_started
+    trace.add('serialize', max(0.0, request_duration - trace.duration - (trace.started - g.request_started)))
+    payload_bytes = 0 if response.is_streamed else len(response.get_data())
+    callback_metrics.record(trace, payload_bytes)
+    if METRICS_SERVER_TIMING:
+        response.headers['Server-Timing'] = ', '.join(
+            f'{stage_name};dur={seconds * 1000:.2f}' for stage_name, seconds in trace.stages.items()
+        )
+    return response
+
+@metrics_routes.route('/metrics')
+def metrics():
+    return Response(callback_metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,102 @@
+from dash import html, dcc, dash_table, Output, Input, State, register_page, callback
+import logging
+import threading
+import psycopg2
+import dash_bootstrap_components as dbc
+from dash.exceptions import PreventUpdate
+from pages.alerts import FIRE_THRESHOLD
+from pages.database import PoolTimeout
+from pages.metrics import instrumented
+from pages.registry import LATEST_READINGS_MAX_AGE, get_registry, latest_readings
+
+# Seconds between overview refreshes, the shared snapshot is re-read at most this often
+REFRESH_INTERVAL = LATEST_READINGS_MAX_AGE
+
+
+# Function to summarize every registered block from the shared latest-reading snapshot.
+# The rows are built once per snapshot version and shared by every client.
+def collect_overview_data():
+    data, version = latest_readings.current()
+    registry = get_registry()
+    with overview_lock:
+        if overview_state['key'] != (version, registry):
+            summary_df = registry.summary.summarize(data, FIRE_THRESHOLD)
+            summary_df['max_temperature'] = summary_df['max_temperature'].round(1)
+            overview_state['rows'] = summary_df.astype(object).where(summary_df.notna(), None).to_dict('records')
+            overview_state['key'] = (version, registry)
+        return overview_state['rows'], version
+
+
+#-------------------------- Initialization --------------------------#
+register_page(__name__, path="/block-overview")
+overview_lock = threading.Lock()
+overview_state = {'key': None, 'rows': None}
+
+
+#---------------------- Block Overview Page Content -----------------------------#
+# Table of every block, hottest first, with blocks that have units on fire highlighted
+def block_overview_table(rows):
+    return dash_table.DataTable(
+        id='block-overview-table',
+        data=rows,
+        columns=[
+            {'name': 'Block', 'id': 'block'},
+            {'name': 'Max Temperature', 'id': 'max_temperature', 'type': 'numeric'},
+            {'name': 'Hottest Level', 'id': 'level'},
+            {'name': 'Hottest Unit', 'id': 'unit'},
+            {'name': f'Units at {FIRE_THRESHOLD}°C or more', 'id': 'units_over_threshold', 'type': 'numeric'},
+        ],
+        filter_action='native',
+        sort_action='native',
+        page_size=50,
+        style_data_conditional=[
+            {
+                'if': {'filter_query': '{units_over_threshold} > 0'},
+                'backgroundColor': '#f8d7da',
+                'fontWeight': 'bold',
+            }
+        ],
+    )
+
+#---------------------- Block overview page layout --------------------------#
+def layout():
+    try:
+        rows, version = collect_overview_data()
+    except (psycopg2.Error, PoolTimeout) as error:
+        # The table fills in on the next refresh once the database is reachable again
+        logging.getLogger(__name__).warning('Block overview unavailable: %s', error)
+        rows, version = [], None
+    return dbc.Card(
+        dbc.CardBody(
+            [
+                html.H5("Block Overview", className="card-title"),
+                html.P(
+                    "Latest temperature of every building block, hottest first"
+                ),
+                block_overview_table(rows),
+                # Version of the readings the client's table shows, so unchanged refreshes send nothing
+                dcc.Store(id='block-overview-version', data=version),
+                dcc.Interval(
+                    id='block-overview-interval',
+                    interval=REFRESH_INTERVAL*1000, # in milliseconds
+                    n_intervals=0
+                )
+            ]
+        )
+    )
+
+
+#---------------------- Callback Functions --------------------------#
+# Callback function to refresh the overview table periodically
+@callback(
+    Output('block-overview-table', 'data'),
+    Output('block-overview-version', 'data'),
+    Input('block-overview-interval', 'n_intervals'),
+    State('block-overview-version', 'data'),
+)
+@instrumented('block-overview.update_overview')
+def update_overview(n_intervals, client_version):
+    rows, version = collect_overview_data()
+    if version == client_version:
+        raise PreventUpdate
+    return rows, version
@@ -0,0 +1,66 @@
+import os
+import re
+
+import pandas as pd
+import psycopg2.extensions
+
+### This file contains the server-side prepared statements of the queries run on every
+### refresh, so Postgres parses and plans them once per connection instead of once per call
+
+
+# Whether the hot queries run as server-side prepared statements. Turn it off behind a
+# pooler that does not keep a client on one server session (pgbouncer in transaction mode)
+PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1').lower() not in ('0', 'false', 'no')
+
+
+# Connection remembering which prepared statements exist on its server session
+class PreparingConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+# Server-side prepared statement of a query written with named %(...)s placeholders like
+# every other query. The query is sent once per connection as PREPARE with $n parameters,
+# and every call then runs EXECUTE with the values bound by psycopg2, so repeat calls skip
+# parsing and planning: Postgres plans the first five executions for their values and then
+# switches to a cached generic plan unless it is clearly worse. Prepared statements live as
+# long as the pooled connection, which is why they are tracked on it.
+class PreparedStatement:
+    def __init__(self, name, query, enabled=PREPARED_STATEMENTS):
+        self.name = name
+        self.query = query
+        self.enabled = enabled
+        self.parameters = []
+        def number(match):
+            if match.group(1) not in self.parameters:
+                self.parameters.append(match.group(1))
+            return f'${self.parameters.index(match.group(1)) + 1}'
+        self.prepare_sql = f'PREPARE {name} AS ' + re.sub(r'%\((\w+)\)s', number, query).strip().rstrip(';')
+        self.execute_sql = f'EXECUTE {name}' + (f' ({", ".join(f"%({parameter})s" for parameter in self.parameters)})' if self.parameters else '')
+
+    # Function to prepare the statement on the connection's session unless it already is
+    def prepare(self, connection):
+        if self.name in connection.prepared:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(self.prepare_sql)
+        connection.prepared.add(self.name)
+
+    # Connections that do not track their prepared statements (opened outside the pool)
+    # run the plain query
+    def usable_on(self, connection):
+        return self.enabled and isinstance(connection, PreparingConnection)
+
+    def execute(self, cursor, params):
+        if not self.usable_on(cursor.connection):
+            return cursor.execute(self.query, params)
+        self.prepare(cursor.connection)
+        cursor.execute(self.execute_sql, params)
+
+    # Function to run the statement into a DataFrame, like pd.read_sql_query
+    def read(self, connection, params, **kwargs):
+        if not self.usable_on(connection):
+            return pd.read_sql_query(self.query, con=connection, params=params, **kwargs)
+        self.prepare(connection)
+        return pd.read_sql_query(self.execute_sql, con=connection, params=params, **kwargs)
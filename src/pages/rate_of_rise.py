@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+### This file contains the rate-of-rise analysis overlaid on the historical graph
+
+
+# Function to compute the rate of rise of a temperature series in °C per minute.
+# The series is first averaged over a trailing time window (from a running sum, the
+# window's first sample found by binary search), then each point is compared with the
+# average one window earlier, so the whole series is done in a handful of vectorized
+# passes. The window is widened to span at least min_samples samples, so a series with
+# few samples per window is averaged out rather than read as a jump. Points with less
+# than half a window of history have no rate. Returns (rate series, window in seconds actually used).
+def rate_of_rise(series, window, min_samples=4):
+    series = series.dropna()
+    if not series.index.is_monotonic_increasing:
+        series = series.sort_index()
+    if len(series) < 2:
+        return pd.Series(dtype=float), window
+    times = series.index.values.astype('datetime64[ns]').astype(np.int64) / 1e9
+    window = max(window, min_samples * float(np.median(np.diff(times))))
+
+    # Mean of the samples in (t - window, t], as the rolling mean of a time window
+    totals = np.concatenate([[0.0], np.cumsum(series.values.astype(float))])
+    first = np.searchsorted(times, times - window, side='right')
+    last = np.arange(1, len(times) + 1)
+    averaged = (totals[last] - totals[first]) / (last - first)
+    earlier = np.searchsorted(times, times - window)
+    span = times - times[earlier]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = (averaged - averaged[earlier]) / span * 60
+    rate[span < window / 2] = np.nan
+    return pd.Series(rate, index=series.index), window
+
+# Function to return the time the rate first reaches the threshold, None if it never does
+def first_crossing(rate, threshold):
+    crossed = rate.values >= threshold
+    if not crossed.any():
+        return None
+    return rate.index[crossed.argmax()]
@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+
+import pandas as pd
+import psycopg2
+
+from pages.block_summary import BlockSummary
+from pages.database import PoolTimeout, pool
+from pages.live_data import LatestReadingSnapshot, fetch_latest_readings
+
+### This file contains the sensor registry mapping every building block to its sensors
+
+
+# Seconds the registry is kept before it is re-read, so new blocks show up without a restart
+REGISTRY_MAX_AGE = 600
+# Minimum seconds between re-reads of the registry triggered by requests for unknown blocks
+REGISTRY_RELOAD_INTERVAL = 5
+# Seconds the snapshot of every registered sensor's latest reading is reused
+LATEST_READINGS_MAX_AGE = 5
+
+# Sensors of Block 123, used to seed the registry the first time it is created
+seed_block = '123'
+seed_sensor_ids = ['42261f3', '422607c', '42262a', '4226087', '4226222', '42261ea']
+
+# The sensor_registry table lists the block, level and unit of every sensor. It is
+# seeded with Block 123, taking each sensor's level and unit from its latest reading.
+registry_setup = '''
+    CREATE TABLE sensor_registry AS
+        SELECT DISTINCT ON (sensorid)
+            %(seed_block)s::text AS block, level, unit, sensorid
+        FROM
+            data
+        WHERE
+            sensorid = ANY(%(seed_sensor_ids)s)
+        ORDER BY
+            sensorid, date DESC;
+    ALTER TABLE sensor_registry ADD PRIMARY KEY (sensorid);
+    CREATE INDEX sensor_registry_block ON sensor_registry (block, level, unit);
+'''
+
+registry_query = '''
+    SELECT
+        block, level, unit, sensorid
+    FROM
+        sensor_registry
+'''
+
+
+### Function to label a house unit the same way as the unit selectors
+def unit_label(level, unit):
+    return f'Level: {level}, Unit: {unit}'
+
+
+# In-memory index of the registry: block -> level -> unit -> sensorid and back
+class SensorRegistry:
+    def __init__(self, registry_df):
+        registry_df = registry_df.sort_values(by=['block', 'level', 'unit'], ignore_index=True)
+        self.blocks = list(registry_df['block'].unique())
+        self.block_sensors = {
+            block: block_df[['sensorid', 'level', 'unit']].reset_index(drop=True)
+            for block, block_df in registry_df.groupby('block', sort=False)
+        }
+        self.sensor_blocks = dict(zip(registry_df['sensorid'], registry_df['block']))
+        self.labels = {
+            sensorid: unit_label(level, unit)
+            for sensorid, level, unit in zip(registry_df['sensorid'], registry_df['level'], registry_df['unit'])
+        }
+        self.sensor_ids = list(registry_df['sensorid'])
+        self.summary = BlockSummary(registry_df)
+
+    def has_block(self, block):
+        return block in self.block_sensors
+
+    def sensors(self, block):
+        return tuple(self.block_sensors[block]['sensorid'])
+
+    def levels(self, block):
+        return tuple(sorted(self.block_sensors[block]['level'].unique()))
+
+    def units(self, block):
+        return tuple(sorted(self.block_sensors[block]['unit'].unique()))
+
+    # Function to list the (label, sensorid) of every unit in a block, ordered by level and unit
+    def unit_options(self, block):
+        return [(self.labels[sensorid], sensorid) for sensorid in self.block_sensors[block]['sensorid']]
+
+    # Function to pick a block's sensors out of a snapshot of all readings. Every sensor of
+    # the block gets a row, with a missing temperature when it has not reported yet, so the
+    # rows always line up with the block's heatmap grid.
+    def block_readings(self, block, readings_df):
+        return self.block_sensors[block].merge(
+            readings_df[['sensorid', 'temperature', 'date']], on='sensorid', how='left'
+        )
+
+
+# Function to create the sensor_registry table if it does not exist yet, checking under an
+# advisory lock so concurrent workers do not both create it
+def ensure_registry(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('firenet.registry_setup'))")
+        cursor.execute("SELECT to_regclass('sensor_registry')")
+        if cursor.fetchone()[0] is None:
+            cursor.execute(registry_setup, {'seed_block': seed_block, 'seed_sensor_ids': seed_sensor_ids})
+    connection.commit()
+
+def load_registry():
+    with pool.connection() as connection:
+        ensure_registry(connection)
+        return SensorRegistry(pd.read_sql_query(registry_query, con=connection))
+
+
+registry_lock = threading.Lock()
+registry_state = {'registry': None, 'loaded_at': 0.0}
+
+# Function to return the in-memory registry, loading it on first use and re-reading it
+# every REGISTRY_MAX_AGE seconds. Requests never look sensor metadata up in the database.
+def get_registry():
+    if registry_state['registry'] is None or time.monotonic() - registry_state['loaded_at'] >= REGISTRY_MAX_AGE:
+        with registry_lock:
+            if registry_state['registry'] is None or time.monotonic() - registry_state['loaded_at'] >= REGISTRY_MAX_AGE:
+                registry_state['registry'] = load_registry()
+                registry_state['loaded_at'] = time.monotonic()
+    return registry_state['registry']
+
+# Function to check that a block is registered. A block missing from the in-memory registry
+# re-reads it first (at most every REGISTRY_RELOAD_INTERVAL seconds), so a block registered
+# since the last load is served on its first request rather than after REGISTRY_MAX_AGE
+def knows_block(block):
+    if get_registry().has_block(block):
+        return True
+    with registry_lock:
+        if time.monotonic() - registry_state['loaded_at'] >= REGISTRY_RELOAD_INTERVAL:
+            registry_state['registry'] = load_registry()
+            registry_state['loaded_at'] = time.monotonic()
+    return get_registry().has_block(block)
+
+# Function to list the registered blocks for the block selectors, empty while the database
+# cannot be reached so the pages still render
+def available_blocks():
+    try:
+        return get_registry().blocks
+    except (psycopg2.Error, PoolTimeout) as error:
+        logging.getLogger(__name__).warning('Sensor registry unavailable: %s', error)
+        return []
+
+
+# Function to query the latest temperature reading of every registered sensor
+def fetch_registered_readings():
+    with pool.connection() as connection:
+        return fetch_latest_readings(connection, get_registry().sensor_ids)
+
+# Snapshot of the latest reading of every registered sensor, shared by the live pages
+# so each tick costs one query however many blocks are being watched
+latest_readings = LatestReadingSnapshot(fetch_registered_readings, max_age=LATEST_READINGS_MAX_AGE)
@@ -0,0 +1,192 @@
+import argparse
+
+import pandas as pd
+
+from pages.database import TableCheck, pool
+from pages.prepared import PreparedStatement
+
+### This file contains the pre-aggregated rollup tables used by the historical graph.
+### Each rollup keeps the min, max, sum and count of temperature per sensor and time bucket.
+### Rebuild the rollups of a date range from the src folder with:
+###     python -m pages.rollups backfill --start 2023-09-01 --end 2023-10-01
+
+
+# Rollup tables with their bucket widths, coarsest first
+rollups = [
+    ('sensor_rollup_1hour', '1 hour'),
+    ('sensor_rollup_10min', '10 minutes'),
+    ('sensor_rollup_1min', '1 minute'),
+]
+
+rollup_select = '''
+    SELECT
+        date_bin(interval '{interval}', date, '2000-01-01') AS bucket,
+        sensorid,
+        min(temperature) AS min_temperature,
+        max(temperature) AS max_temperature,
+        sum(temperature) AS sum_temperature,
+        count(*) AS count
+    FROM
+        {source}
+    WHERE
+        sensorid IS NOT NULL
+        {condition}
+    GROUP BY
+        1, 2
+'''
+
+# New readings are folded into the existing buckets, so out-of-order batches are fine
+rollup_merge = '''
+    INSERT INTO {table} ({select})
+    ON CONFLICT (sensorid, bucket) DO UPDATE SET
+        min_temperature = LEAST({table}.min_temperature, EXCLUDED.min_temperature),
+        max_temperature = GREATEST({table}.max_temperature, EXCLUDED.max_temperature),
+        sum_temperature = {table}.sum_temperature + EXCLUDED.sum_temperature,
+        count = {table}.count + EXCLUDED.count;
+'''
+
+# Backfilled buckets are recomputed from scratch and replace whatever was there
+rollup_replace = '''
+    INSERT INTO {table} ({select})
+    ON CONFLICT (sensorid, bucket) DO UPDATE SET
+        min_temperature = EXCLUDED.min_temperature,
+        max_temperature = EXCLUDED.max_temperature,
+        sum_temperature = EXCLUDED.sum_temperature,
+        count = EXCLUDED.count;
+'''
+
+rollup_query = '''
+    SELECT
+        bucket, min_temperature, max_temperature, sensorid
+    FROM
+        {table}
+    WHERE
+        sensorid = ANY(%(sensor_ids)s) AND
+        bucket >= %(start)s AND
+        bucket < %(end)s
+    ORDER BY
+        bucket
+'''
+
+# Raw readings, read when no rollup is coarse enough for the range
+raw_series_query = '''
+    SELECT
+        date, temperature, sensorid
+    FROM
+        data
+    WHERE
+        sensorid = ANY(%(sensor_ids)s) AND
+        date >= %(start)s AND
+        date < %(end)s
+    ORDER BY
+        date
+'''
+
+# The historical and rollup queries run as prepared statements, one per rollup table
+raw_series_statement = PreparedStatement('raw_series', raw_series_query)
+rollup_statements = {table: PreparedStatement(f'rollup_series_{table}', rollup_query.format(table=table)) for table, _ in rollups}
+
+
+# Function to build the SQL creating every rollup table, seeding it from data and
+# attaching the statement-level trigger that keeps it current as readings arrive
+def rollup_setup():
+    statements = ['LOCK TABLE data IN SHARE ROW EXCLUSIVE MODE;']
+    merges = []
+    for table, interval in rollups:
+        statements.append(f'CREATE TABLE {table} AS {rollup_select.format(interval=interval, source="data", condition="")};')
+        statements.append(f'ALTER TABLE {table} ADD PRIMARY KEY (sensorid, bucket);')
+        merges.append(rollup_merge.format(table=table, select=rollup_select.format(interval=interval, source='new_rows', condition='')))
+    statements.append('''
+        CREATE OR REPLACE FUNCTION data_rollups_upsert() RETURNS trigger AS $$
+        BEGIN
+            {merges}
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE OR REPLACE TRIGGER data_rollups
+            AFTER INSERT ON data
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION data_rollups_upsert();
+    '''.format(merges=''.join(merges)))
+    return '\n'.join(statements)
+
+# Function to create the rollup tables and their trigger if they do not exist yet, checking
+# under an advisory lock so concurrent runs do not both create them. Seeding reads the whole
+# data table and blocks ingest meanwhile, so it runs from the setup step (pages/setup.py)
+# or the backfill command, never from a page
+def ensure_rollups(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('firenet.rollup_setup'))")
+        cursor.execute("SELECT to_regclass(%s)", (rollups[-1][0],))
+        if cursor.fetchone()[0] is None:
+            cursor.execute(rollup_setup())
+    connection.commit()
+
+# Function to tell whether the rollup tables exist, the historical graph reads the raw readings
+# until the setup step has created them (all at once, so checking the last one is enough)
+rollups_ready = TableCheck(rollups[-1][0])
+
+# Function to pick the coarsest rollup that still gives at least max_points samples
+# (two per bucket) over the range, None when only the raw readings are fine enough
+def choose_rollup(start, end, max_points):
+    for table, interval in rollups:
+        if (pd.Timestamp(end) - pd.Timestamp(start)) / pd.Timedelta(interval) * 2 >= max_points:
+            return table, interval
+    return None
+
+# Function to read a rollup as (date, temperature, sensorid) rows. Every bucket gives
+# two samples, its minimum at the bucket start and its maximum half a bucket later,
+# so the graph keeps the envelope of the readings
+def fetch_rollup(connection, table, interval, start, end, sensor_ids):
+    params = {
+        'sensor_ids': list(sensor_ids),
+        'start': start,
+        'end': end
+    }
+    rollup_df = rollup_statements[table].read(connection, params, parse_dates=['bucket'])
+    minimums = rollup_df.rename(columns={'bucket': 'date', 'min_temperature': 'temperature'})
+    maximums = rollup_df.rename(columns={'bucket': 'date', 'max_temperature': 'temperature'})
+    maximums['date'] = maximums['date'] + pd.Timedelta(interval) / 2
+    columns = ['date', 'temperature', 'sensorid']
+    return pd.concat([minimums[columns], maximums[columns]], ignore_index=True)
+
+# Function to recompute every rollup bucket in [start, end) from the raw readings, one day per transaction
+def backfill_rollups(connection, start, end):
+    day = pd.Timestamp(start).floor('D')
+    while day < pd.Timestamp(end):
+        next_day = day + pd.Timedelta(days=1)
+        params = {'start': day, 'end': next_day}
+        with connection.cursor() as cursor:
+            for table, interval in rollups:
+                cursor.execute(f'DELETE FROM {table} WHERE bucket >= %(start)s AND bucket < %(end)s', params)
+                select = rollup_select.format(interval=interval, source='data', condition='AND date >= %(start)s AND date < %(end)s')
+                cursor.execute(rollup_replace.format(table=table, select=select), params)
+        connection.commit()
+        print(f'Backfilled {day.date()}')
+        day = next_day
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Maintain the historical rollup tables')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backfill = subparsers.add_parser('backfill', help='recompute the rollups of a date range from the raw readings')
+    backfill.add_argument('--start', help='first day to rebuild (default: earliest reading)')
+    backfill.add_argument('--end', help='day to stop before (default: day after the latest reading)')
+    args = parser.parse_args()
+
+    with pool.connection() as connection:
+        ensure_rollups(connection)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT min(date), max(date) FROM data')
+            earliest, latest = cursor.fetchone()
+        if earliest is None:
+            print('No readings to backfill')
+            return
+        start = args.start or earliest
+        end = args.end or pd.Timestamp(latest).floor('D') + pd.Timedelta(days=1)
+        backfill_rollups(connection, start, end)
+
+
+if __name__ == '__main__':
+    main()
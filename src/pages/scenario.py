@@ -0,0 +1,136 @@
+import numpy as np
+
+### This file contains the scenario engine simulating the temperatures of a building on fire,
+### used by the demo generator, the demo heatmap and the load test tools.
+### Whole (levels x units) frames are computed at once with NumPy, level 1 is row 0.
+
+
+MAX_LEVELS = 200
+MAX_UNITS = 50
+
+# Longest step the heat equation is integrated over in one go, longer steps are split up
+# so the explicit update stays stable
+MAX_SUBSTEP = 1.0
+
+
+# Fire breaking out in units (0-based) of level (1-based) at `start` seconds into the scenario
+class Fire:
+    def __init__(self, level, units, start=0):
+        self.level = level
+        self.units = list(units)
+        self.start = start
+
+    def __repr__(self):
+        return f'Fire(level={self.level}, units={self.units}, start={self.start})'
+
+
+# Function to pick `count` fires of up to `width` neighbouring units on random levels
+def random_fires(count, levels, units, rng, start=0, width=3):
+    fires = []
+    for _ in range(count):
+        first_unit = int(rng.integers(units))
+        fires.append(Fire(int(rng.integers(1, levels + 1)), range(first_unit, min(units, first_unit + width)), start))
+    return fires
+
+
+# Temperatures of a (levels x units) building over time. Heat diffuses between neighbouring
+# units of a level and, faster upwards than downwards, between levels, and every unit slowly
+# cools back to the ambient temperature. Burning units are heated towards the flame
+# temperature until they burn out, and a unit heated past the ignition temperature catches
+# fire with probability spread_rate per second, so fires spread through the building. The
+# random numbers come from one generator seeded with `seed`: the same seed replays the same
+# scenario, frame for frame.
+class Scenario:
+    def __init__(
+        self, levels, units, fires=(), seed=None,
+        ambient=32.0, flame=90.0, ignition=45.0, noise=1.0,
+        lateral=0.05, upward=0.08, downward=0.02, cooling=0.01,
+        heating=0.5, spread_rate=0.05, burn_time=600.0,
+    ):
+        if not (1 <= levels <= MAX_LEVELS and 1 <= units <= MAX_UNITS):
+            raise ValueError(f'buildings are 1 to {MAX_LEVELS} levels by 1 to {MAX_UNITS} units, not {levels} x {units}')
+        for fire in fires:
+            if not 1 <= fire.level <= levels or any(not 0 <= unit < units for unit in fire.units):
+                raise ValueError(f'{fire} is outside the {levels} x {units} building')
+        self.levels = levels
+        self.units = units
+        self.shape = (levels, units)
+        self.fires = list(fires)
+        self.seed = seed
+        self.ambient = ambient
+        self.flame = flame
+        self.ignition = ignition
+        self.noise = noise
+        self.lateral = lateral
+        self.upward = upward
+        self.downward = downward
+        self.cooling = cooling
+        self.heating = heating
+        self.spread_rate = spread_rate
+        self.burn_time = burn_time
+        self.restart()
+
+    # Function to rewind the scenario to its start, with the random generator reseeded
+    def restart(self):
+        self.rng = np.random.default_rng(self.seed)
+        self.elapsed = 0.0
+        self.temperatures = np.full(self.shape, self.ambient)
+        self.burning = np.zeros(self.shape, dtype=bool)
+        self.burnt = np.zeros(self.shape, dtype=bool)
+        self.burn_left = np.zeros(self.shape)
+        self.pending = sorted(self.fires, key=lambda fire: fire.start)
+        self.ignite_fires()
+
+    def ignite_fires(self):
+        while self.pending and self.pending[0].start <= self.elapsed:
+            fire = self.pending.pop(0)
+            cells = (np.full(len(fire.units), fire.level - 1), np.array(fire.units, dtype=int))
+            self.burning[cells] = True
+            self.burnt[cells] = False
+            self.burn_left[cells] = self.burn_time
+
+    # Function to advance the simulation by dt seconds, at most MAX_SUBSTEP
+    def advance(self, dt):
+        t = self.temperatures
+        padded = np.pad(t, 1, mode='edge')
+        below, above = padded[:-2, 1:-1], padded[2:, 1:-1]
+        left, right = padded[1:-1, :-2], padded[1:-1, 2:]
+        change = (
+            self.lateral * (left + right - 2 * t)
+            + self.upward * (below - t)
+            + self.downward * (above - t)
+            + self.cooling * (self.ambient - t)
+            + np.where(self.burning, self.heating * (self.flame - t), 0.0)
+        )
+        self.temperatures = t + dt * change
+
+        catching = ~self.burning & ~self.burnt & (self.temperatures >= self.ignition)
+        catching &= self.rng.random(self.shape) < self.spread_rate * dt
+        self.burning |= catching
+        self.burn_left[catching] = self.burn_time
+
+        self.burn_left[self.burning] -= dt
+        burnt_out = self.burning & (self.burn_left <= 0)
+        self.burning &= ~burnt_out
+        self.burnt |= burnt_out
+
+        self.elapsed += dt
+        self.ignite_fires()
+
+    # Function to advance the scenario by `seconds` and return the sensor readings of the
+    # building at that time, rounded to a tenth of a degree
+    def step(self, seconds=1.0):
+        remaining = seconds
+        while remaining > 1e-9:
+            dt = min(MAX_SUBSTEP, remaining)
+            self.advance(dt)
+            remaining -= dt
+        return self.frame()
+
+    def frame(self):
+        readings = self.temperatures + self.rng.normal(0.0, self.noise, self.shape) if self.noise else self.temperatures
+        return np.round(readings, 1)
+
+    # True once every fire has broken out and burnt out and the building has cooled down
+    def finished(self):
+        return not self.pending and not self.burning.any() and self.temperatures.max() < self.ignition
@@ -0,0 +1,20 @@
+from pages.database import pool
+from pages.live_data import ensure_sensor_latest
+from pages.rollups import ensure_rollups
+
+### This file creates the derived tables and triggers the pages read from. Creating them seeds
+### them from the whole data table with ingest blocked meanwhile, so it is an explicit step
+### run at deploy time rather than something a page request may trigger. Until it has run the
+### pages read the raw readings. Run from the src folder (it does nothing once all exist):
+###     python -m pages.setup
+
+
+def main():
+    with pool.connection() as connection:
+        ensure_sensor_latest(connection)
+        ensure_rollups(connection)
+    print('Database setup complete')
+
+
+if __name__ == '__main__':
+    main()
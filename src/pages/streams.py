@@ -0,0 +1,58 @@
+import json
+import queue
+
+from flask import Blueprint, Response, abort, stream_with_context
+
+from pages.live_data import watchers
+
+### This file contains the server-sent event streams pushing live heatmap changes to the browser
+
+
+# Seconds between keepalive comments on an idle stream, so proxies keep the connection open
+KEEPALIVE_INTERVAL = 15
+
+stream_routes = Blueprint('streams', __name__)
+
+
+# Stream of changed heatmap cells for one live page (and block), one event per change after
+# a first event holding every cell
+@stream_routes.route('/streams/<name>')
+@stream_routes.route('/streams/<name>/<topic>')
+def live_stream(name, topic=None):
+    watcher = watchers.get(name)
+    if watcher is None:
+        abort(404)
+    subscription = watcher.subscribe(topic)
+    # The stream opens with the full current state, a client that connects late or reconnects
+    # after missing changes has nothing to apply them to otherwise. Changes queued before it
+    # was read are already part of it.
+    try:
+        while True:
+            subscription.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        baseline = watcher.baseline(topic)
+    except Exception:
+        watcher.unsubscribe(subscription, topic)
+        raise
+
+    def events():
+        try:
+            yield 'retry: 5000\n\n'
+            if baseline is not None:
+                yield f'data: {json.dumps(baseline)}\n\n'
+            while True:
+                try:
+                    message = subscription.get(timeout=KEEPALIVE_INTERVAL)
+                    yield f'data: {json.dumps(message)}\n\n'
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+        finally:
+            watcher.unsubscribe(subscription, topic)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -0,0 +1,71 @@
+import math
+
+import pandas as pd
+
+from pages.cache import ResultCache, ttl_for_range
+from pages.downsampling import minmax_downsample
+from pages.metrics import stage
+
+### This file contains the multi-resolution tile cache behind the historical graph
+
+
+# Cache of downsampled historical series cut into time tiles.
+# Tiles at zoom level L are base_width * 2**L wide and aligned to the epoch, and every
+# tile keeps at most points_per_tile samples per unit. A window is drawn from the
+# level whose tiles are about 1/tiles_per_view of its width, so the point count per
+# line stays bounded at any zoom while repeated pans over the same incident are served
+# from memory. Tiles reaching into the present are still filling up and expire quickly.
+class TileCache:
+    def __init__(self, fetch, base_width, points_per_tile, tiles_per_view, max_tiles):
+        # fetch(start, end, units) returns a DataFrame with one column per unit on a timestamp index,
+        # holding the readings in [start, end) so a reading on a tile boundary lands in one tile only
+        self.fetch = fetch
+        self.base_width = pd.Timedelta(base_width)
+        self.points_per_tile = points_per_tile
+        self.tiles_per_view = tiles_per_view
+        self.tiles = ResultCache(max_tiles)
+
+    def level_for(self, start, end):
+        span = (end - start) / (self.base_width * self.tiles_per_view)
+        return max(0, math.ceil(math.log2(span))) if span > 0 else 0
+
+    def tile_width(self, level):
+        return self.base_width * 2 ** level
+
+    def load_tile(self, tile_start, tile_end, units):
+        tile_df = self.fetch(tile_start, tile_end, units)
+        tile = {}
+        with stage('downsample'):
+            for column in tile_df.columns:
+                series = tile_df[column].dropna()
+                x, y = minmax_downsample(series.index, series.values, self.points_per_tile)
+                tile[column] = pd.Series(y, index=x)
+        return tile
+
+    def get_tile(self, level, index, units):
+        width = self.tile_width(level)
+        tile_start = pd.Timestamp(0) + index * width
+        tile_end = tile_start + width
+        return self.tiles.get_or_compute(
+            (level, index, units),
+            lambda: self.load_tile(tile_start, tile_end, units),
+            ttl=ttl_for_range(tile_end)
+        )
+
+    # Function to return {unit: series} covering [start, end] at the resolution suited to the window.
+    # units must be hashable (a sorted tuple) since it is part of the tile key
+    def get_window(self, start, end, units):
+        level = self.level_for(start, end)
+        width = self.tile_width(level)
+        first = (start - pd.Timestamp(0)) // width
+        last = (end - pd.Timestamp(0)) // width
+        pieces = {}
+        for index in range(first, last + 1):
+            for column, series in self.get_tile(level, index, units).items():
+                pieces.setdefault(column, []).append(series)
+
+        window = {}
+        for column, series_list in pieces.items():
+            series = pd.concat(series_list)
+            window[column] = series[(series.index >= start) & (series.index <= end)]
+        return window